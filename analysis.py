@@ -0,0 +1,149 @@
+import collections
+import json
+import os
+import sqlite3
+
+import chess.engine
+import chess.polyglot
+
+CachedAnalysis = collections.namedtuple("CachedAnalysis", ["multipv", "depth"])
+
+def positionKey(board):
+    """Zobrist hash of the position, covers placement, side to move, castling rights and en passant"""
+    return chess.polyglot.zobrist_hash(board)
+
+def analysisDepth(multipv):
+    return multipv[0].get("depth", 0) if multipv else 0
+
+def covers(cached, multipv, depth):
+    """Whether a cached analysis has at least multipv lines searched to at least depth"""
+    return cached is not None and cached.depth >= depth and len(cached.multipv) >= multipv
+
+def encodeInfo(info):
+    """JSON-able copy of an engine info dict, the score relative to the side to move"""
+    data = {"depth": info.get("depth", 0), "multipv": info.get("multipv", 1), "pv": [move.uci() for move in info.get("pv", [])]}
+    score = info.get("score")
+    if score is not None:
+        relative = score.relative
+        if relative.is_mate():
+            data["mate"] = relative.mate()
+        else:
+            data["cp"] = relative.score()
+    return data
+
+def decodeInfo(data, turn):
+    info = {"depth": data["depth"], "multipv": data["multipv"], "pv": [chess.Move.from_uci(uci) for uci in data["pv"]]}
+    if "mate" in data:
+        relative = chess.engine.MateGiven if data["mate"] == 0 else chess.engine.Mate(data["mate"])
+        info["score"] = chess.engine.PovScore(relative, turn)
+    elif "cp" in data:
+        info["score"] = chess.engine.PovScore(chess.engine.Cp(data["cp"]), turn)
+    return info
+
+class AnalysisStore():
+    """SQLite table of the deepest multipv analysis per position (zobrist hash), kept across sessions
+
+    Filled by main.py as it searches and ahead of time by precompute.py."""
+    def __init__(self, path="data/analysis.sqlite"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS analysis (
+            key INTEGER PRIMARY KEY, fen TEXT, depth INTEGER, lines INTEGER, multipv TEXT)""")
+        self.db.commit()
+
+    @staticmethod
+    def key(board):
+        # sqlite integers are signed 64 bit
+        key = positionKey(board)
+        return key - (1 << 64) if key >= 1 << 63 else key
+
+    def get(self, board):
+        row = self.db.execute("SELECT depth, multipv FROM analysis WHERE key = ?", (self.key(board),)).fetchone()
+        if row is None:
+            return None
+        return CachedAnalysis([decodeInfo(data, board.turn) for data in json.loads(row[1])], row[0])
+
+    def put(self, board, multipv):
+        """Store multipv unless the position is stored deeper (or as deep with at least as many lines)"""
+        depth = analysisDepth(multipv)
+        if not depth:
+            return
+        self.db.execute("""INSERT INTO analysis VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET
+            fen = excluded.fen, depth = excluded.depth, lines = excluded.lines, multipv = excluded.multipv
+            WHERE excluded.depth > analysis.depth OR (excluded.depth = analysis.depth AND excluded.lines > analysis.lines)""",
+            (self.key(board), board.fen(), depth, len(multipv), json.dumps([encodeInfo(info) for info in multipv])))
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+class AnalysisCache():
+    """LRU cache of the latest multipv snapshot per position
+
+    Lets a position that comes back (e.g. after a one frame misread) show its lines immediately
+    instead of waiting for the engine to search it again. With an AnalysisStore, misses are
+    looked up there and deeper snapshots are written through to it."""
+    def __init__(self, maxsize=256, store=None):
+        self.maxsize = maxsize
+        self.store = store
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.store_hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, board):
+        key = positionKey(board)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = self.store.get(board) if self.store is not None else None
+            if entry is not None:
+                self.store_hits += 1
+                self.insert(key, entry)
+            return entry
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def insert(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, board, multipv):
+        """Store a snapshot of multipv, unless a deeper one is already cached for the position"""
+        depth = analysisDepth(multipv)
+        if not depth:
+            return
+        key = positionKey(board)
+        entry = self.entries.get(key)
+        if entry is None or entry.depth <= depth:
+            if self.store is not None and (entry is None or entry.depth < depth or len(entry.multipv) < len(multipv)):
+                self.store.put(board, multipv)
+            entry = CachedAnalysis([dict(info) for info in multipv], depth)
+        self.insert(key, entry)
+
+    def freshest(self, cached, multipv):
+        """The live multipv, or the cached snapshot while the live search is still shallower"""
+        if cached and analysisDepth(multipv) < cached.depth:
+            return cached.multipv
+        return multipv
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "store_hits": self.store_hits,
+        }
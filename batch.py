@@ -0,0 +1,177 @@
+"""Offline batch analysis of screenshots and screen recordings
+
+Streams frames from image files, directories or videos, recognises the board of every frame in a
+process pool and writes one JSON line per frame (source, detection status, FEN, timing). With
+--depth every unique position is also evaluated at that depth by a pool of UCI engines. At most
+a fixed number of frames is in flight, so memory stays bounded whatever the input size.
+
+    python batch.py saved/ --depth 16 --engine engines/stockfish_14_x64_avx2 > positions.jsonl
+"""
+import argparse
+import collections
+import concurrent.futures
+import glob
+import json
+import os
+import shlex
+import sys
+import time
+
+import chess
+import chess.engine
+import numpy as np
+from PIL import Image
+
+from engines import EnginePool
+
+image_extensions = (".png", ".jpg", ".jpeg", ".bmp")
+
+def iterFrames(paths):
+    """(source, path or RGB array) of every frame, image files are opened by the workers"""
+    for path in paths:
+        if os.path.isdir(path):
+            for f in sorted(glob.glob(os.path.join(path, "*"))):
+                if f.lower().endswith(image_extensions):
+                    yield f, f
+        elif path.lower().endswith(image_extensions):
+            yield path, path
+        else:
+            import imageio.v3 as iio
+            for i, frame in enumerate(iio.imiter(path)):
+                yield f"{path}#{i}", np.asarray(frame)[:, :, :3]
+
+def boundedMap(executor, fn, items, depth):
+    """executor.map that keeps at most depth items in flight and yields results in order"""
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+recognise_options = {}
+
+def initWorker(options):
+    recognise_options.update(options)
+
+def recognise(frame):
+    """Board recognition of one frame, runs in a worker process"""
+    import predict
+    import vision
+
+    source, data = frame
+    start = time.perf_counter()
+    image = Image.open(data) if isinstance(data, str) else Image.fromarray(data)
+    if recognise_options["region"]:
+        image = image.crop(recognise_options["region"])
+    is_match, tiles = vision.img2tiles(image)
+    record = {"source": source, "is_match": bool(is_match), "fen": None}
+    if is_match:
+        board = predict.predictBoard(tiles, recognise_options["is_white"])
+        board.turn = recognise_options["turn"]
+        board.castling_rights = board.clean_castling_rights()
+        record["fen"] = board.fen()
+    record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return record
+
+class Evaluator(EnginePool):
+    """Fixed depth evaluation of positions on a pool of UCI engines, one engine per thread
+
+    Repeated positions are answered from an LRU cache (or share the evaluation in flight)."""
+    def __init__(self, command, depth, workers, cache_size=10000):
+        super().__init__(command, workers)
+        self.depth = depth
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    def analyse(self, fen):
+        board = chess.Board(fen)
+        info = self.engine().analyse(board, chess.engine.Limit(depth=self.depth))
+        score = info.get("score")
+        pv = info.get("pv") or []
+        return {
+            "cp": score.white().score() if score else None,
+            "mate": score.white().mate() if score else None,
+            "depth": info.get("depth"),
+            "bestmove": pv[0].uci() if pv else None,
+            "pv": [move.uci() for move in pv],
+        }
+
+    def submit(self, fen):
+        """Future of the evaluation of fen (white's point of view)"""
+        key = fen.rsplit(" ", 2)[0]
+        with self.lock:
+            future = self.cache.get(key)
+            if future is not None:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return future
+            self.misses += 1
+            future = self.executor.submit(self.analyse, fen)
+            self.cache[key] = future
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return future
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="image files, directories of images or videos")
+    parser.add_argument("--output", help="JSON-lines output (default: stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="recognition processes")
+    parser.add_argument("--black", action="store_true", help="boards are shown from black's side")
+    parser.add_argument("--turn", choices=["white", "black"], default="white", help="side to move for the FEN and evaluation")
+    parser.add_argument("--region", type=lambda r: tuple(int(v) for v in r.split(",")), default=None,
+                        help="left,top,right,bottom crop applied to every frame")
+    parser.add_argument("--depth", type=int, default=None, help="evaluate every unique position at this depth")
+    parser.add_argument("--engine", default="engines/stockfish_14_x64_avx2", help="UCI engine command")
+    parser.add_argument("--engines", type=int, default=max((os.cpu_count() or 2) // 2, 1), help="number of engine processes")
+    parser.add_argument("--in-flight", type=int, default=None, help="frames in flight at once (default: 4 per worker)")
+    args = parser.parse_args()
+
+    options = {"region": args.region, "is_white": not args.black, "turn": args.turn == "white"}
+    in_flight = args.in_flight or 4 * args.workers
+    out = open(args.output, "w") if args.output else sys.stdout
+    evaluator = Evaluator(shlex.split(args.engine), args.depth, args.engines) if args.depth else None
+
+    frames = 0
+    matches = 0
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(args.workers, initializer=initWorker, initargs=(options,)) as executor:
+        records = boundedMap(executor, recognise, iterFrames(args.inputs), in_flight)
+        if evaluator:
+            def evaluate(record):
+                if record["fen"] and chess.Board(record["fen"]).is_valid():
+                    record["eval"] = evaluator.submit(record["fen"])
+                return record
+            records = (evaluate(record) for record in records)
+            # keep a bounded number of evaluations queued before writing them out in order
+            pending = collections.deque()
+            def resolved(records):
+                for record in records:
+                    pending.append(record)
+                    if len(pending) >= in_flight:
+                        yield pending.popleft()
+                while pending:
+                    yield pending.popleft()
+            records = resolved(records)
+
+        for record in records:
+            if "eval" in record:
+                record["eval"] = record["eval"].result()
+            frames += 1
+            matches += record["is_match"]
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+    if evaluator:
+        evaluator.close()
+    summary = f"{frames} frames, {matches} boards in {time.perf_counter() - start:.1f}s"
+    if evaluator:
+        summary += f", {evaluator.misses} positions evaluated, {evaluator.hits} repeated"
+    print(summary, file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
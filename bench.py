@@ -0,0 +1,172 @@
+"""Headless benchmark of the capture-to-render path
+
+Times every stage on the screenshot fixtures (demo.png plus the captures in saved/ and images/),
+reports p50/p95/p99 in milliseconds and writes them as JSON. With --baseline the run fails if any
+stage got slower than the baseline by more than --tolerance.
+
+    python bench.py --output bench.json
+    python bench.py --baseline bench.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import shlex
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import chess
+import chess.svg
+import numpy as np
+from PIL import Image
+
+import predict
+import vision
+import visualizer
+from engines import EngineManager
+
+def loadFixtures(paths):
+    """(name, image) of every fixture, full screenshots are cropped to the left half like the default capture region"""
+    fixtures = []
+    for path in paths:
+        image = Image.open(path).convert("RGB")
+        if os.path.basename(path) == "demo.png":
+            image = image.crop((0, 0, image.width//2+50, image.height))
+        fixtures.append((path, image))
+    return fixtures
+
+class Timings():
+    def __init__(self):
+        self.samples = {}
+
+    def time(self, stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+        return result
+
+    def summary(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            stages[stage] = {"n": len(samples), "mean": float(np.mean(samples)),
+                             "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        return stages
+
+def benchVision(timings, fixtures, repeat):
+    """Times img2tiles split into its stages, returns the recognised boards"""
+    boards = []
+    for name, image in fixtures:
+        for _ in range(repeat):
+            a = timings.time("grayscale", lambda: np.asarray(image.convert("L"), dtype=np.float32))
+            hough_Dx, hough_Dy = timings.time("gradient", vision.hough_numpy, a)
+            lines_x, lines_y, is_match = timings.time("getChessLines", vision.getChessLines, hough_Dx, hough_Dy,
+                                                      hough_Dx.max() * 3 / 5 * 0.9, hough_Dy.max() * 3 / 5 * 0.9)
+            if is_match:
+                squares = timings.time("getChessTiles", vision.getChessTiles, a, lines_x, lines_y)
+                timings.time("resize", vision.resampleTiles, squares)
+            is_match, tiles = timings.time("img2tiles", vision.img2tiles, image)
+            if is_match:
+                board = timings.time("predictBoard", predict.predictBoard, tiles, True)
+        if not is_match:
+            print(f"no board found in {name}", file=sys.stderr)
+            continue
+        boards.append(board)
+    return boards
+
+def benchRender(timings, boards, multipvs, repeat):
+    vis = visualizer.Visualizer(fps=0, idle_fps=0)
+    for board, (multipv_allie, multipv_enemy) in zip(boards, multipvs):
+        enemy = board.copy()
+        enemy.turn = chess.BLACK
+        for _ in range(repeat):
+            svg = chess.svg.board(board=board, size=400, coordinates=False)
+            timings.time("svg2surface", visualizer.svg2surface, svg)
+            timings.time("BoardRenderer", vis.board_renderer.render, board, True)
+            vis.invalidate()
+            timings.time("render_frame", vis.render_frame, board, multipv_allie, enemy, multipv_enemy, True, board)
+            timings.time("render_frame_unchanged", vis.render_frame, board, multipv_allie, enemy, multipv_enemy, True, board)
+
+def analyse(engine, boards, wait):
+    """multipv of both sides of every board from the (stub) engine"""
+    engines = EngineManager(engine, threads=2)
+    while not engines.ready():
+        time.sleep(0.01)
+    multipvs = []
+    for board in boards:
+        enemy = board.copy()
+        enemy.turn = chess.BLACK
+        engines.analyse("allie", board)
+        engines.analyse("enemy", enemy)
+        deadline = time.perf_counter() + wait
+        while time.perf_counter() < deadline and any(s.task is None or not s.task.done() for s in engines.searches.values()):
+            time.sleep(0.05)
+        multipvs.append((engines.multipv("allie"), engines.multipv("enemy")))
+    engines.quit()
+    return multipvs
+
+def compare(result, baseline, tolerance):
+    """Returns the stages whose p50 regressed by more than tolerance against the baseline"""
+    regressions = []
+    for stage, stats in baseline["stages"].items():
+        current = result["stages"].get(stage)
+        if current and current["p50"] > stats["p50"] * (1 + tolerance):
+            regressions.append((stage, stats["p50"], current["p50"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", nargs="*", help="screenshots (default: demo.png, saved/*.png, images/*.png)")
+    parser.add_argument("--repeat", type=int, default=20, help="iterations per fixture")
+    parser.add_argument("--engine", default=f"{sys.executable} stub_engine.py", help="UCI engine command")
+    parser.add_argument("--engine-wait", type=float, default=5.0, help="seconds to let the engine analyse each fixture")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown against the baseline")
+    args = parser.parse_args()
+
+    # headless boxes usually lack the Ubuntu fonts, fall back to the pygame default font
+    if not os.path.exists(visualizer.font_dir):
+        visualizer.font_dir = visualizer.font_bold_dir = None
+
+    paths = args.fixtures or ["demo.png"] + sorted(glob.glob("saved/*.png")) + sorted(glob.glob("images/*.png"))
+    fixtures = loadFixtures(paths)
+
+    timings = Timings()
+    boards = benchVision(timings, fixtures, args.repeat)
+    multipvs = analyse(shlex.split(args.engine), boards, args.engine_wait)
+    benchRender(timings, boards, multipvs, args.repeat)
+
+    stages = timings.summary()
+    frame = sum(stages[s]["p50"] for s in ("img2tiles", "predictBoard", "render_frame") if s in stages)
+    result = {
+        "meta": {"time": time.time(), "python": platform.python_version(), "machine": platform.machine(),
+                 "fixtures": len(fixtures), "boards": len(boards), "repeat": args.repeat},
+        "stages": stages,
+        "fps": 1000 / frame if frame else None,
+    }
+
+    print(f"{'stage':24s} {'n':>5s} {'p50':>8s} {'p95':>8s} {'p99':>8s}  (ms)")
+    for stage, stats in stages.items():
+        print(f"{stage:24s} {stats['n']:5d} {stats['p50']:8.2f} {stats['p95']:8.2f} {stats['p99']:8.2f}")
+    if result["fps"]:
+        print(f"capture-to-render fps (p50): {result['fps']:.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for stage, before, after in regressions:
+            print(f"regression: {stage} p50 {before:.2f} ms -> {after:.2f} ms", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Screen capture backends
+
+Every backend grabs a region (left, top, right, bottom) of the screen as an RGB PIL image:
+
+    pil     PIL.ImageGrab, works everywhere PIL can grab the screen
+    xshm    X11 shared memory through the optional mss package, only copies the region
+    <path>  replays an image file, a directory of images or a video (needs imageio) as the screen
+"""
+import glob
+import os
+
+from PIL import Image, ImageGrab
+
+class PILCapture():
+    def size(self):
+        return ImageGrab.grab().size
+
+    def grab(self, region=None):
+        return ImageGrab.grab(bbox=region)
+
+class XShmCapture():
+    """Grabs through MIT-SHM, mss keeps the shared memory segment and reuses it between grabs"""
+    def __init__(self):
+        import mss
+        self.sct = mss.mss()
+        self.monitor = self.sct.monitors[0]
+
+    def size(self):
+        return self.monitor["width"], self.monitor["height"]
+
+    def grab(self, region=None):
+        left, top, right, bottom = region or (0, 0, *self.size())
+        shot = self.sct.grab({"left": self.monitor["left"] + left, "top": self.monitor["top"] + top,
+                              "width": right - left, "height": bottom - top})
+        return Image.frombuffer("RGB", shot.size, shot.bgra, "raw", "BGRX", 0, 1)
+
+class ReplayCapture():
+    """Plays back recorded frames as if they were the screen, one frame per grab
+
+    path is an image, a directory of images (in name order) or a video. At the end it starts over
+    when loop is set, otherwise the last frame is repeated and self.done is set."""
+    image_extensions = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, path, loop=True):
+        self.path = path
+        self.loop = loop
+        self.done = False
+        if os.path.isdir(path):
+            self.files = sorted(f for f in glob.glob(os.path.join(path, "*")) if f.lower().endswith(self.image_extensions))
+        elif path.lower().endswith(self.image_extensions):
+            self.files = [path]
+        else:
+            self.files = None
+        self.still = None
+        self.frames = self.open()
+        self.frame = next(self.frames)
+
+    def open(self):
+        if self.files is not None and len(self.files) == 1:
+            # a single image is decoded once and replayed from memory
+            if self.still is None:
+                self.still = Image.open(self.files[0]).convert("RGB")
+            return iter([self.still])
+        if self.files is not None:
+            return (Image.open(f).convert("RGB") for f in self.files)
+        import imageio.v3 as iio
+        return (Image.fromarray(frame).convert("RGB") for frame in iio.imiter(self.path))
+
+    def size(self):
+        return self.frame.size
+
+    def grab(self, region=None):
+        frame = self.frame
+        try:
+            self.frame = next(self.frames)
+        except StopIteration:
+            if self.loop:
+                self.frames = self.open()
+                self.frame = next(self.frames)
+            else:
+                self.done = True
+        return frame.crop(region) if region else frame
+
+def openCapture(name):
+    """Capture backend by name, anything else is treated as a replay path"""
+    if name == "pil":
+        return PILCapture()
+    if name == "xshm":
+        return XShmCapture()
+    return ReplayCapture(name)
+
+class RegionGrabber():
+    """Grabs the tracked board region while the tracker is locked, the base region otherwise
+
+    The base region defaults to the left half of the screen plus 50px. Calling it returns the image
+    and its origin in the base region, ready for tracker.img2tiles(image, origin)."""
+    def __init__(self, capture, tracker=None, region=None):
+        self.capture = capture
+        self.tracker = tracker
+        if region is None:
+            width, height = capture.size()
+            region = (0, 0, width//2+50, height)
+        self.region = region
+
+    def grabBase(self):
+        return self.capture.grab(self.region)
+
+    def __call__(self):
+        left, top = self.region[:2]
+        if self.tracker and self.tracker.bbox is not None:
+            x0, y0, x1, y1 = self.tracker.bbox
+            return self.capture.grab((left + x0, top + y0, left + x1, top + y1)), (x0, y0)
+        return self.grabBase(), (0, 0)
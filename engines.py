@@ -0,0 +1,221 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+import chess
+import chess.engine
+
+# lines of a search that has none yet, always the same object so the visualizer sees nothing changed
+no_lines = [{}]
+
+class Search():
+    """One engine process and the state of its current analysis"""
+    def __init__(self, name, share, full_breadth):
+        self.name = name
+        self.share = share
+        self.full_breadth = full_breadth
+        self.engine = None
+        self.threads = 1
+        # threads the engine was last configured with, the search applies a change before its next stage
+        self.configured = None
+        self.task = None
+        self.board = None
+        self.published = (None, no_lines)
+        self.stage = None
+        # concurrent.futures.Future of starting the engine
+        self.opened = None
+
+class EnginePool():
+    """Blocking UCI engines for offline analysis, one per thread of a ThreadPoolExecutor
+
+    Subclasses submit their work to self.executor and call self.engine() from it."""
+    def __init__(self, command, workers, threads=1):
+        self.command = command
+        self.threads = threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.local = threading.local()
+        self.engines = []
+        self.lock = threading.Lock()
+
+    def engine(self):
+        """The engine of the calling thread, started on first use"""
+        if not hasattr(self.local, "engine"):
+            self.local.engine = chess.engine.SimpleEngine.popen_uci(self.command)
+            if "Threads" in self.local.engine.options:
+                self.local.engine.configure({"Threads": self.threads})
+            with self.lock:
+                self.engines.append(self.local.engine)
+        return self.local.engine
+
+    def close(self):
+        self.executor.shutdown()
+        for engine in self.engines:
+            engine.quit()
+
+class EngineManager():
+    """Runs one UCI engine per search on a background asyncio loop
+
+    The CPU budget (all cores but one by default) is split between the searches by share. Each
+    analysis runs in stages: a few lines at low depth first so something shows up right away,
+    then as many lines as the ui draws, and finally (for full_breadth searches, whose hover
+    overlay uses every move) all legal moves at full depth. A position only reaches the later
+    stages while it stays on screen. The latest lines are read without blocking via multipv().
+    command is any UCI executable (path or argument list), e.g. the stub_engine.py script."""
+    def __init__(self, command, shares={"allie": 2, "enemy": 1}, full_breadth=("allie",),
+                 threads=None, hash_mb=64, visible_lines=24, depths=(10, 14, 18)):
+        self.command = command
+        self.hash_mb = hash_mb
+        self.visible_lines = visible_lines
+        self.depths = depths
+        self.searches = {name: Search(name, share, name in full_breadth) for name, share in shares.items()}
+
+        self.budget = threads or max((os.cpu_count() or 2) - 1, 1)
+        self.rebalance()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        for search in self.searches.values():
+            search.opened = asyncio.run_coroutine_threadsafe(self.open(search), self.loop)
+
+    def add(self, name, share=1, full_breadth=False):
+        """Start another search, e.g. for one more board on screen, the budget is split again"""
+        search = Search(name, share, full_breadth)
+        self.searches[name] = search
+        self.rebalance()
+        search.opened = asyncio.run_coroutine_threadsafe(self.open(search), self.loop)
+
+    def remove(self, name):
+        """Stop the named search and quit its engine, the budget is split again"""
+        search = self.searches.pop(name)
+        self.rebalance()
+        async def quit():
+            if search.task:
+                search.task.cancel()
+            await asyncio.wrap_future(search.opened)
+            await search.engine.quit()
+        asyncio.run_coroutine_threadsafe(quit(), self.loop)
+
+    def ready(self):
+        """Whether every engine is up, raises if one failed to start"""
+        for search in self.searches.values():
+            if not search.opened.done():
+                return False
+            search.opened.result()
+        return True
+
+    def call(self, coro):
+        """Run a coroutine on the engine loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def rebalance(self):
+        """Split the budget between the searches by share, at least one thread each"""
+        total = sum(search.share for search in self.searches.values())
+        exact = {search: self.budget * search.share / total for search in self.searches.values()}
+        for search, threads in exact.items():
+            search.threads = int(threads)
+        # the threads left over by rounding down go to the largest remainders
+        left = self.budget - sum(search.threads for search in exact)
+        for search in sorted(exact, key=lambda search: search.threads - exact[search])[:left]:
+            search.threads += 1
+        # a search left without one takes it from the one with the most (over budget only if there are more searches than threads)
+        for search in exact:
+            if search.threads == 0:
+                richest = max(exact, key=lambda search: search.threads)
+                if richest.threads > 1:
+                    richest.threads -= 1
+                search.threads = 1
+
+    def spare(self):
+        """Whether another search still gets a thread of its own within the budget"""
+        return len(self.searches) < self.budget
+
+    async def open(self, search):
+        _, search.engine = await chess.engine.popen_uci(self.command)
+        await self.configure(search)
+
+    async def configure(self, search):
+        threads = search.threads
+        options = {}
+        if "Threads" in search.engine.options:
+            options["Threads"] = min(threads, search.engine.options["Threads"].max)
+        if "Hash" in search.engine.options:
+            options["Hash"] = min(self.hash_mb * threads, search.engine.options["Hash"].max)
+        await search.engine.configure(options)
+        search.configured = threads
+
+    def schedule(self, search, board):
+        """(multipv, depth) stages for analysing board"""
+        legal = board.legal_moves.count()
+        visible = min(self.visible_lines, legal)
+        stages = [(min(4, visible), self.depths[0]), (visible, self.depths[1])]
+        stages.append((legal if search.full_breadth else visible, self.depths[-1]))
+        return [stage for i, stage in enumerate(stages) if stage[0] and stage not in stages[:i]]
+
+    async def run(self, search, board):
+        # a restart cancels this task, which must not cancel opening the engine along with it
+        await asyncio.shield(asyncio.wrap_future(search.opened))
+        depth_shown = 0
+        for multipv, depth in self.schedule(search, board):
+            if search.configured != search.threads:
+                await self.configure(search)
+            search.stage = (multipv, depth)
+            with await search.engine.analysis(board, chess.engine.Limit(depth=depth), multipv=multipv) as analysis:
+                async for info in analysis:
+                    # publish once a depth iteration has reported all of its lines, and only once the
+                    # wider stage has caught up with the depth already shown (the engine hash makes it quick)
+                    if info.get("multipv", 1) == multipv and info.get("depth", 0) >= depth_shown:
+                        search.published = (board, [info.copy() for info in analysis.multipv])
+                        depth_shown = info.get("depth", 0)
+            if analysis.multipv[0].get("depth", 0) >= depth_shown:
+                search.published = (board, [info.copy() for info in analysis.multipv])
+                depth_shown = analysis.multipv[0].get("depth", 0)
+        search.stage = None
+
+    def restart(self, search, board):
+        if search.task:
+            search.task.cancel()
+        search.task = self.loop.create_task(self.run(search, board))
+
+    def analyse(self, name, board):
+        """Start analysing board in the named search, replacing whatever it was analysing"""
+        search = self.searches[name]
+        search.board = board.copy()
+        self.loop.call_soon_threadsafe(self.restart, search, search.board)
+
+    def target(self, name, board):
+        """(multipv, depth) the named search would finish analysing board at, None if board has no legal moves"""
+        stages = self.schedule(self.searches[name], board)
+        return stages[-1] if stages else None
+
+    def hold(self, name, board):
+        """Switch the named search to board without searching it, for a board whose lines are
+        known already; multipv() returns [{}] until the next analyse()"""
+        search = self.searches[name]
+        search.board = board.copy()
+        self.loop.call_soon_threadsafe(lambda: search.task and search.task.cancel())
+
+    def stop(self, name):
+        """Stop the named search, keeping the lines it reached"""
+        search = self.searches[name]
+        self.loop.call_soon_threadsafe(lambda: search.task and search.task.cancel())
+
+    def multipv(self, name):
+        """Latest lines of the named search, [{}] until the current board has any"""
+        search = self.searches[name]
+        board, multipv = search.published
+        return multipv if board is search.board else no_lines
+
+    def quit(self):
+        async def quit_all():
+            for search in self.searches.values():
+                if search.task:
+                    search.task.cancel()
+                try:
+                    await asyncio.wrap_future(search.opened)
+                except Exception:
+                    continue
+                await search.engine.quit()
+        self.call(quit_all())
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,148 @@
+import datetime
+import os
+
+import chess
+import chess.pgn
+
+class GameState():
+    """The game behind the recognised positions, as a chess.Board with its move stack
+
+    A new placement is linked to the current position by the legal move, or sequence of up to
+    max_plies moves (e.g. a premove answered within one frame), that produces it. A placement
+    seen up to max_takeback plies earlier (a takeback, or the last frame was misread) goes back
+    there. Anything else starts over from the placement alone, with the side to move given and
+    the castling rights the king and rook squares still allow; the game so far is kept for the
+    PGN export, and is picked up again if a later placement links to it (the start over was a
+    misread frame). Since the board keeps its move stack, engines get the root position plus the
+    moves, with the real side to move, castling and en passant rights and repetitions."""
+    def __init__(self, max_plies=2, max_takeback=8):
+        self.max_plies = max_plies
+        self.max_takeback = max_takeback
+        self.board = None
+        # the game before the last start over
+        self.previous = None
+        self.games = []
+
+        self.moves_found = 0
+        self.takebacks = 0
+        self.resyncs = 0
+        self.restores = 0
+
+    def resync(self, placement, turn):
+        # the last game with moves is kept to go back to, a game that starts over straight away again was a misread
+        if self.board is not None and (self.board.move_stack or self.previous is None):
+            self.previous = self.board
+        if self.board is not None and self.board.move_stack:
+            self.games.append(self.board)
+        if placement.board_fen() == chess.STARTING_BOARD_FEN:
+            self.board = chess.Board()
+        else:
+            self.board = chess.Board(None)
+            self.board.set_board_fen(placement.board_fen())
+            self.board.turn = turn
+            self.board.castling_rights = chess.BB_CORNERS
+            self.board.castling_rights = self.board.clean_castling_rights()
+        self.resyncs += 1
+
+    def findMoves(self, target, plies):
+        """Moves from the current position to the placement of target (a chess.BaseBoard), None if there are none"""
+        changed = 0
+        for color in chess.COLORS:
+            for piece_type in chess.PIECE_TYPES:
+                changed |= self.board.pieces_mask(piece_type, color) ^ target.pieces_mask(piece_type, color)
+        if plies == 0 or not changed:
+            return [] if not changed else None
+        # a move changes at most 4 squares (castling)
+        if chess.popcount(changed) > 4 * plies:
+            return None
+        # every move of the sequence leaves its from square to the other side or empty, so it must differ
+        for move in self.board.generate_legal_moves(from_mask=changed):
+            self.board.push(move)
+            try:
+                moves = self.findMoves(target, plies - 1)
+            finally:
+                self.board.pop()
+            if moves is not None:
+                return [move] + moves
+        return None
+
+    def follow(self, target):
+        """Link the current game to the placement of target (a chess.BaseBoard), returns the moves
+        pushed or None if it cannot be linked"""
+        board_fen = target.board_fen()
+        if self.board.board_fen() == board_fen:
+            return []
+
+        # the side to move after starting over was only a guess, the first move found settles it
+        turns = [self.board.turn] if self.board.move_stack else [self.board.turn, not self.board.turn]
+        for side in turns:
+            self.board.turn = side
+            for plies in range(1, self.max_plies + 1):
+                moves = self.findMoves(target, plies)
+                if moves is not None:
+                    for move in moves:
+                        self.board.push(move)
+                    self.moves_found += len(moves)
+                    return moves
+        self.board.turn = turns[0]
+
+        for plies in range(1, min(self.max_takeback, len(self.board.move_stack)) + 1):
+            if self.board.copy(stack=plies).root().board_fen() == board_fen:
+                for _ in range(plies):
+                    self.board.pop()
+                self.takebacks += 1
+                return []
+        return None
+
+    def update(self, placement, turn=chess.WHITE):
+        """Follow the game to placement (a board, only its pieces count), returns the moves pushed
+
+        turn is the side to move if the game has to start over from placement."""
+        target = chess.BaseBoard(placement.board_fen())
+        if self.board is None:
+            self.resync(placement, turn)
+            return []
+        moves = self.follow(target)
+        if moves is not None:
+            return moves
+
+        # after a misread frame the game it interrupted goes on from where it was
+        if self.previous is not None:
+            current, self.board = self.board, self.previous
+            moves = self.follow(target)
+            if moves is not None:
+                self.games = [board for board in self.games if board is not self.board]
+                self.previous = None
+                self.restores += 1
+                return moves
+            self.board = current
+
+        self.resync(placement, turn)
+        return []
+
+    def position(self, turn):
+        """The position to analyse for turn: the game itself (with its moves) if turn is to move,
+        otherwise the same placement with turn to move, as a bare FEN"""
+        if self.board.turn == turn:
+            return self.board.copy()
+        board = chess.Board(None)
+        board.set_board_fen(self.board.board_fen())
+        board.turn = turn
+        board.castling_rights = self.board.castling_rights
+        board.castling_rights = board.clean_castling_rights()
+        return board
+
+    def exportPgn(self, directory="games"):
+        """Write every game followed so far (with at least one move) to a new PGN file, returns its path"""
+        os.makedirs(directory, exist_ok=True)
+        now = datetime.datetime.now()
+        path = os.path.join(directory, now.strftime("%Y%m%d-%H%M%S.pgn"))
+        with open(path, "w") as f:
+            for board in self.games + [self.board]:
+                if board is None or not board.move_stack:
+                    continue
+                game = chess.pgn.Game.from_board(board)
+                game.headers["Event"] = "Live Chess Analyzer"
+                game.headers["Date"] = now.strftime("%Y.%m.%d")
+                print(game, file=f, end="\n\n")
+        return path
@@ -0,0 +1,97 @@
+"""NumPy forward pass of the piece classifier
+
+exportModel writes the weights of the trained MLPClassifier to an uncompressed .npz (float32, or
+int8 with a float32 scale per output unit), MLP loads it back without importing scikit-learn and
+provides the predict / predict_proba / classes_ interface predict.py uses. Any number of tiles,
+e.g. of several boards, is classified with one matmul per layer.
+
+    python inference.py [--int8]
+"""
+import argparse
+import time
+
+import numpy as np
+
+activations = {
+    "identity": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "tanh": lambda x: np.tanh(x, out=x),
+    "logistic": lambda x: np.reciprocal(1 + np.exp(-x, out=x), out=x),
+}
+
+def exportModel(clf, path="models/clf.npz", quantize=False):
+    arrays = {
+        "classes": clf.classes_,
+        "activation": np.array(clf.activation),
+        "out_activation": np.array(clf.out_activation_),
+        "layers": np.array(len(clf.coefs_)),
+    }
+    for i, (coef, intercept) in enumerate(zip(clf.coefs_, clf.intercepts_)):
+        if quantize:
+            scale = np.abs(coef).max(0) / 127
+            scale[scale == 0] = 1
+            arrays[f"coef{i}"] = np.rint(coef / scale).astype(np.int8)
+            arrays[f"scale{i}"] = scale.astype(np.float32)
+        else:
+            arrays[f"coef{i}"] = coef.astype(np.float32)
+        arrays[f"intercept{i}"] = intercept.astype(np.float32)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+class MLP():
+    def __init__(self, path="models/clf.npz"):
+        with np.load(path) as f:
+            self.classes_ = f["classes"]
+            self.activation = activations[str(f["activation"])]
+            self.out_activation = str(f["out_activation"])
+            self.coefs = []
+            self.intercepts = []
+            for i in range(int(f["layers"])):
+                coef = f[f"coef{i}"]
+                if coef.dtype == np.int8:
+                    coef = coef.astype(np.float32) * f[f"scale{i}"]
+                self.coefs.append(coef)
+                self.intercepts.append(f[f"intercept{i}"])
+
+    def predict_proba(self, X):
+        a = np.asarray(X, dtype=np.float32).reshape(len(X), -1)
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            a = a @ coef
+            a += intercept
+            if i < len(self.coefs) - 1:
+                a = self.activation(a)
+        if self.out_activation == "softmax":
+            a -= a.max(1, keepdims=True)
+            np.exp(a, out=a)
+            a /= a.sum(1, keepdims=True)
+        else:
+            a = activations[self.out_activation](a)
+            if a.shape[1] == 1:
+                a = np.hstack([1 - a, a])
+        return a
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(1)]
+
+if __name__ == "__main__":
+    from joblib import load
+
+    from tilestore import TileStore
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="models/clf.joblib")
+    parser.add_argument("--output", default="models/clf.npz")
+    parser.add_argument("--int8", action="store_true", help="quantise the weights to int8")
+    parser.add_argument("--store", default="data/tiles", help="tile store to check the predictions against")
+    args = parser.parse_args()
+
+    clf = load(args.model)
+    exportModel(clf, args.output, args.int8)
+    start = time.perf_counter()
+    mlp = MLP(args.output)
+    print(f"exported {args.output}, loads in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    X, y = TileStore(args.store).arrays()
+    if len(y):
+        agree = np.count_nonzero(mlp.predict(X) == clf.predict(np.asarray(X, dtype=np.float32)))
+        print(f"agrees with sklearn on {agree}/{len(y)} stored tiles, accuracy {np.mean(mlp.predict(X) == y)}")
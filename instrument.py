@@ -0,0 +1,127 @@
+import collections
+import json
+import threading
+import time
+
+import numpy as np
+
+class Stage():
+    """Context manager adding its wall time in ms to a profiler stage"""
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+class NullStage():
+    """Stage used while profiling is disabled, does nothing"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+null_stage = NullStage()
+
+class Profiler():
+    """Per-frame stage timers and counters with rolling windows, optionally traced to a JSON-lines file
+
+    While disabled stage() hands out a shared no-op context manager, so instrumented code costs one
+    attribute check. Counters are always kept, they are plain integer increments."""
+    def __init__(self, enabled=False, window=300, trace_path=None):
+        self.enabled = enabled or trace_path is not None
+        self.window = window
+        self.samples = {}
+        self.current = {}
+        self.counters = collections.Counter()
+        self.frames = 0
+        self.frame_start = time.perf_counter()
+        self.trace = open(trace_path, "a") if trace_path else None
+
+    def stage(self, name):
+        return Stage(self, name) if self.enabled else null_stage
+
+    def record(self, name, ms):
+        if name not in self.samples:
+            self.samples[name] = collections.deque(maxlen=self.window)
+        self.samples[name].append(ms)
+        self.current[name] = self.current.get(name, 0.0) + ms
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def end_frame(self):
+        """Close the current frame: record its total time and write its trace line"""
+        now = time.perf_counter()
+        self.frames += 1
+        if self.enabled:
+            self.record("frame", (now - self.frame_start) * 1000)
+            if self.trace:
+                self.trace.write(json.dumps({"t": time.time(), "frame": self.frames,
+                                             "stages": self.current, "counters": dict(self.counters)}) + "\n")
+        self.current = {}
+        self.frame_start = now
+
+    def summary(self):
+        """{stage: (p50, p95, max)} over the rolling window, in ms"""
+        summary = {}
+        for name, samples in list(self.samples.items()):
+            if samples:
+                p50, p95 = np.percentile(samples, [50, 95])
+                summary[name] = (p50, p95, max(samples))
+        return summary
+
+    def close(self):
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+
+class Startup():
+    """Startup time breakdown: the steps up to the first frame, then the work left in the background"""
+    def __init__(self, start):
+        self.start = start
+        self.last = start
+        self.steps = []
+        self.pending = {}
+
+    def mark(self, name):
+        """End the step name, timed from the end of the previous step"""
+        now = time.perf_counter()
+        self.steps.append((name, (now - self.last) * 1000))
+        self.last = now
+
+    def background(self, name, is_done):
+        """Report when is_done() first returns true"""
+        self.pending[name] = is_done
+
+    def thread(self, name, target):
+        """Run target on a daemon thread and report how long after the start it returned"""
+        finished = []
+        def run():
+            target()
+            finished.append(time.perf_counter())
+        threading.Thread(target=run, daemon=True).start()
+        self.pending[name] = lambda: finished and finished[0]
+
+    def report(self):
+        steps = ", ".join(f"{name} {ms:.0f}ms" for name, ms in self.steps)
+        print(f"startup: {steps}, first frame after {(self.last - self.start) * 1000:.0f}ms")
+
+    def poll(self):
+        for name, is_done in list(self.pending.items()):
+            done = is_done()
+            if done:
+                # is_done may return when it finished
+                finished = done if done is not True else time.perf_counter()
+                print(f"startup: {name} ready after {(finished - self.start) * 1000:.0f}ms")
+                del self.pending[name]
@@ -1,84 +1,151 @@
+import argparse
 import base64
+import shlex
 import sys
 import os
+import time
+startup_begin = time.perf_counter()
 
 import chess
 import chess.engine
-import numpy as np
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 import pygame
 import pyperclip
-from joblib import dump, load
-from PIL import Image, ImageGrab
+from PIL import Image
 
 import vision
 import visualizer
-
-clf = load("models/clf.joblib")
-
-def predictBoard(tiles, is_white):
-    X = tiles.reshape([64, 1024])
-    y = clf.predict(X)
-    if not is_white:
-        y = np.flip(y)
-    board = chess.Board()
-    board.clear_board()
-    for sqi, psymbol in enumerate(y):
-        if psymbol != " ":
-            board.set_piece_at(sqi, chess.Piece.from_symbol(psymbol))
-    return board
+from analysis import AnalysisCache, AnalysisStore, covers
+from capture import RegionGrabber, openCapture
+from engines import EngineManager
+from gamestate import GameState
+from instrument import Profiler, Startup
+from pipeline import RateMeter, VisionWorker
+from session import BoardSession
+from tileindex import TileIndex
+from predict import BoardStabilizer, TilePredictor, getModel, predictBoard
 
 stockfish_dir = "engines/stockfish_14_x64_avx2"
 
-def main():
+def main(pipeline=False, engine=stockfish_dir, threads=None, hash_mb=64, renderer="pygame", fps=30,
+         profile=False, trace=None, capture="pil", region=None, boards=1,
+         analysis="data/analysis.sqlite"):
+    # the window comes up while the model loads and the engines start in the background
+    startup = Startup(startup_begin)
+    startup.mark("imports")
+    startup.thread("model", getModel)
+
     is_white = True
     pygame.display.set_caption("White" if is_white else "Black")
     board = chess.Board()
 
-    engine_allie = chess.engine.SimpleEngine.popen_uci(stockfish_dir)
+    engines = EngineManager(shlex.split(engine), threads=threads, hash_mb=hash_mb)
+    startup.background("engines", engines.ready)
     engine_allie_board = None
-    engine_allie_result = None
-    engine_enemy = chess.engine.SimpleEngine.popen_uci(stockfish_dir)
+    engine_allie_cached = None
     engine_enemy_board = None
-    engine_enemy_result = None
+    engine_enemy_cached = None
+    # positions seen before, in this session or (with a store) any earlier one or precompute.py,
+    # show their last lines right away while the engine catches up
+    analysis_cache = AnalysisCache(store=AnalysisStore(analysis) if analysis else None)
+    # the moves between the recognised positions, the side to move gets searched with them
+    game = GameState()
+
+    # stage timers are off (near free) until enabled here or by toggling the hud with d
+    profiler = Profiler(enabled=profile, trace_path=trace)
 
     def quit():
-        engine_allie.quit()
-        engine_enemy.quit()
+        if worker:
+            worker.stop()
+        for board, name in ((engine_allie_board, "allie"), (engine_enemy_board, "enemy")):
+            if board is not None:
+                analysis_cache.put(board, engines.multipv(name))
+        engines.quit()
+        profiler.close()
+        index.save()
+        if predictor.frames:
+            print(f"tile predictor: {predictor.stats()}")
+        print(f"tile index: {index.stats()}")
+        print(f"analysis cache: {analysis_cache.stats()}")
+        if analysis_cache.store is not None:
+            analysis_cache.store.close()
         sys.exit()
 
-    vis = visualizer.Visualizer()
+    # without the pipeline the frame rate is also the capture rate, a new position must not wait for an idle frame
+    vis = visualizer.Visualizer(renderer=renderer, fps=fps, idle_fps=5 if pipeline and boards == 1 else None, profiler=profiler)
+    startup.mark("window")
+    tracker = vision.BoardTracker()
+    # tiles seen before skip the classifier
+    index = TileIndex.load()
+    predictor = TilePredictor(stabilizer=BoardStabilizer(), index=index)
+    # with several boards the whole region is searched every frame, the focused board (tab cycles
+    # through them) is shown and analysed like a single board, the others get a search of their own
+    session = BoardSession(index=index) if boards > 1 else None
+    focus = None
+    # once the board is locked only its region is grabbed, several boards are looked for on the whole screen
+    screen = openCapture(capture)
+    if session:
+        grab = RegionGrabber(screen, None, region or (0, 0, *screen.size()))
+    else:
+        grab = RegionGrabber(screen, tracker, region)
+    startup.mark("capture")
+
+    # in pipeline mode capture and vision run on their own thread, the ui only takes the newest board
+    worker = None
+    if pipeline and not session:
+        worker = VisionWorker(grab, tracker, predictor, is_white, profiler)
+        worker.start()
+    ui_meter = RateMeter()
+    caption_time = 0
+    first_frame = True
+    refresh = False
 
-    # clock = pygame.time.Clock()
     while True:
         keys = pygame.key.get_pressed()
+        previous_board = board
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 quit()
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                vis.invalidate()
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_q:
                     quit()
                 if event.key == pygame.K_f:
                     is_white = not is_white
+                    # with several boards the orientation is per board, guessed unless flipped here
+                    if session and focus in session.boards:
+                        session.boards[focus].flip()
+                    if worker:
+                        worker.is_white = is_white
                     pygame.display.set_caption("White" if is_white else "Black")
                 if event.key == pygame.K_c:
-                    pyperclip.copy(board.fen())
+                    pyperclip.copy(game.board.fen())
                 if event.key == pygame.K_v:
                     try:
-                        board.set_fen(pyperclip.paste())
+                        board = chess.Board(pyperclip.paste())
                     except ValueError:
                         print("invalid board")
+                    else:
+                        # a pasted position starts a game of its own, with its side to move
+                        game.resync(board, board.turn)
                 if event.key == pygame.K_r:
                     engine_allie_board = None
                     engine_enemy_board = None
+                    # search again even where stored lines would cover the positions
+                    refresh = True
                 if event.key == pygame.K_s:
-                    if engine_allie_result:
-                        engine_allie_result.stop()
-                    if engine_enemy_result:
-                        engine_enemy_result.stop()
+                    engines.stop("allie")
+                    engines.stop("enemy")
+                if event.key == pygame.K_d:
+                    vis.toggle_hud()
+                if event.key == pygame.K_g:
+                    print(f"game stored in {game.exportPgn()}")
+                if event.key == pygame.K_TAB and session and session.boards:
+                    ids = sorted(session.boards)
+                    focus = ids[(ids.index(focus) + 1) % len(ids)] if focus in ids else ids[0]
                 if event.key == pygame.K_p:
-                    image = ImageGrab.grab()
-                    image = image.crop((0, 0, image.width//2+50, image.height))
+                    image = grab.grabBase()
                     is_match, tiles = vision.img2tiles(image)
                     if is_match:
                         board_temp = predictBoard(tiles, is_white)
@@ -88,36 +155,104 @@ def main():
                     else:
                         print("no match found")
 
-        image = ImageGrab.grab()
-        image = image.crop((0, 0, image.width//2+50, image.height))
-        is_match, tiles = vision.img2tiles(image)
-        if is_match:
-            board = predictBoard(tiles, is_white)
-
-        board_temp = board.copy()
-        board_temp.turn = chess.WHITE if is_white else chess.BLACK
-        board_temp.castling_rights = board_temp.clean_castling_rights()
-
-        if board_temp.is_valid() and board_temp != engine_allie_board:
-            engine_allie_board = board_temp.copy()
-            if engine_allie_result:
-                engine_allie_result.stop()
-            engine_allie_result = engine_allie.analysis(engine_allie_board, limit=chess.engine.Limit(depth=18), multipv=500)
-
-        board_temp.turn = chess.BLACK if is_white else chess.WHITE
-        board_temp.castling_rights = board_temp.clean_castling_rights()
-
-        if board_temp.is_valid() and board_temp != engine_enemy_board:
-            engine_enemy_board = board_temp.copy()
-            if engine_enemy_result:
-                engine_enemy_result.stop()
-            engine_enemy_result = engine_enemy.analysis(engine_enemy_board, limit=chess.engine.Limit(depth=18), multipv=24)
-
-        multipv_allie = engine_allie_result.multipv if engine_allie_result else [{}]
-        multipv_enemy = engine_enemy_result.multipv if engine_enemy_result else [{}]
+        if worker:
+            frame = worker.frames.get_latest()
+            if frame and frame.is_match:
+                board = frame.board
+        elif session:
+            with profiler.stage("capture"):
+                image, origin = grab()
+            with profiler.stage("detect"):
+                detections = vision.img2boards(image, boards, origin)
+            with profiler.stage("classify"):
+                tracked = session.update(detections)
+            if focus not in session.boards:
+                focus = tracked[0].id if tracked else None
+            if focus is not None and session.boards[focus].board is not None:
+                board = session.boards[focus].board
+                if is_white != session.boards[focus].is_white:
+                    is_white = session.boards[focus].is_white
+                    pygame.display.set_caption("White" if is_white else "Black")
+            with profiler.stage("engines"):
+                session.analyse(engines, analysis_cache, focus)
+        else:
+            with profiler.stage("capture"):
+                image, origin = grab()
+            with profiler.stage("detect"):
+                is_match, tiles = tracker.img2tiles(image, origin)
+            if is_match:
+                with profiler.stage("classify"):
+                    board = predictor.predictBoard(tiles, is_white)
+            else:
+                profiler.count("detection_misses")
+        if board != previous_board or game.board is None:
+            profiler.count("board_changes")
+            with profiler.stage("game"):
+                game.update(board, chess.WHITE if is_white else chess.BLACK)
+
+        with profiler.stage("engines"):
+            board_temp = game.position(chess.WHITE if is_white else chess.BLACK)
+
+            if board_temp.is_valid() and board_temp != engine_allie_board:
+                if engine_allie_board is not None:
+                    analysis_cache.put(engine_allie_board, engines.multipv("allie"))
+                engine_allie_board = board_temp.copy()
+                engine_allie_cached = analysis_cache.get(engine_allie_board)
+                target = engines.target("allie", engine_allie_board)
+                if not refresh and target is not None and covers(engine_allie_cached, *target):
+                    engines.hold("allie", engine_allie_board)
+                else:
+                    engines.analyse("allie", engine_allie_board)
+                    profiler.count("engine_restarts")
+
+            board_temp = game.position(chess.BLACK if is_white else chess.WHITE)
+
+            if board_temp.is_valid() and board_temp != engine_enemy_board:
+                if engine_enemy_board is not None:
+                    analysis_cache.put(engine_enemy_board, engines.multipv("enemy"))
+                engine_enemy_board = board_temp.copy()
+                engine_enemy_cached = analysis_cache.get(engine_enemy_board)
+                target = engines.target("enemy", engine_enemy_board)
+                if not refresh and target is not None and covers(engine_enemy_cached, *target):
+                    engines.hold("enemy", engine_enemy_board)
+                else:
+                    engines.analyse("enemy", engine_enemy_board)
+                    profiler.count("engine_restarts")
+
+            refresh = False
+            multipv_allie = analysis_cache.freshest(engine_allie_cached, engines.multipv("allie"))
+            multipv_enemy = analysis_cache.freshest(engine_enemy_cached, engines.multipv("enemy"))
         vis.render_frame(engine_allie_board, multipv_allie, engine_enemy_board, multipv_enemy, is_white, board_temp)
+        ui_meter.tick()
+        profiler.end_frame()
+        if first_frame:
+            first_frame = False
+            startup.mark("first frame")
+            startup.report()
+        startup.poll()
 
-        # print(clock.tick(3))
+        if worker and time.perf_counter() - caption_time > 1.0:
+            caption_time = time.perf_counter()
+            pygame.display.set_caption(f"{'White' if is_white else 'Black'} ui {ui_meter.rate:.0f} fps vision {worker.meter.rate:.0f} fps")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pipeline", action="store_true", help="run capture and vision on a separate thread")
+    parser.add_argument("--engine", default=stockfish_dir, help="UCI engine command")
+    parser.add_argument("--threads", type=int, default=None, help="engine threads shared by both searches (default: all cores but one)")
+    parser.add_argument("--hash", type=int, default=64, dest="hash_mb", help="engine hash per thread in MB")
+    parser.add_argument("--renderer", choices=["pygame", "svg"], default="pygame", help="board renderer")
+    parser.add_argument("--fps", type=int, default=30, help="target frame rate of the window")
+    parser.add_argument("--profile", action="store_true", help="time every stage from the start (the d key also turns it on)")
+    parser.add_argument("--trace", help="append per-frame stage timings and counters to this JSON-lines file")
+    parser.add_argument("--capture", default="pil", help="pil, xshm, or an image/directory/video to replay")
+    parser.add_argument("--boards", type=int, default=1,
+                        help="follow up to this many boards on the whole screen, tab switches between them (no --pipeline)")
+    parser.add_argument("--region", type=lambda r: tuple(int(v) for v in r.split(",")), default=None,
+                        help="left,top,right,bottom of the screen to search (default: left half plus 50px)")
+    parser.add_argument("--analysis", default="data/analysis.sqlite",
+                        help="analysis kept across sessions, also filled by precompute.py (empty: in memory only)")
+    args = parser.parse_args()
+    main(pipeline=args.pipeline, engine=args.engine, threads=args.threads, hash_mb=args.hash_mb, renderer=args.renderer, fps=args.fps,
+         profile=args.profile, trace=args.trace, capture=args.capture, region=args.region, boards=args.boards,
+         analysis=args.analysis)
@@ -0,0 +1,86 @@
+import collections
+import threading
+import time
+
+from instrument import Profiler
+
+class LatestQueue():
+    """Bounded queue where the newest item wins, putting into a full queue drops the oldest item"""
+    def __init__(self, maxsize=1):
+        self.items = collections.deque(maxlen=maxsize)
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.lock:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+
+    def get_latest(self):
+        """Returns the newest item and discards the rest, or None if nothing was published since"""
+        with self.lock:
+            if not self.items:
+                return None
+            item = self.items.pop()
+            self.dropped += len(self.items)
+            self.items.clear()
+            return item
+
+class RateMeter():
+    """Exponentially smoothed events per second"""
+    def __init__(self, smoothing=0.9):
+        self.smoothing = smoothing
+        self.last = None
+        self.interval = None
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            dt = now - self.last
+            if self.interval is None:
+                self.interval = dt
+            else:
+                self.interval = self.smoothing * self.interval + (1 - self.smoothing) * dt
+        self.last = now
+
+    @property
+    def rate(self):
+        return 1.0 / self.interval if self.interval else 0.0
+
+Frame = collections.namedtuple("Frame", ["board", "is_match", "timestamp"])
+
+class VisionWorker(threading.Thread):
+    """Runs capture, board detection and classification on its own thread
+
+    grab returns an image and its origin in the frame, like capture.RegionGrabber.
+    Every processed frame is published to self.frames, consumers take whatever is newest.
+    is_white can be changed from other threads and applies from the next frame on."""
+    def __init__(self, grab, tracker, predictor, is_white=True, profiler=None):
+        super().__init__(daemon=True)
+        self.grab = grab
+        self.tracker = tracker
+        self.predictor = predictor
+        self.is_white = is_white
+        self.profiler = profiler or Profiler()
+        self.frames = LatestQueue()
+        self.meter = RateMeter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            with self.profiler.stage("capture"):
+                image, origin = self.grab()
+            with self.profiler.stage("detect"):
+                is_match, tiles = self.tracker.img2tiles(image, origin)
+            board = None
+            if is_match:
+                with self.profiler.stage("classify"):
+                    board = self.predictor.predictBoard(tiles, self.is_white)
+            else:
+                self.profiler.count("detection_misses")
+            self.frames.put(Frame(board, is_match, time.perf_counter()))
+            self.meter.tick()
+
+    def stop(self):
+        self.stopped.set()
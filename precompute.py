@@ -0,0 +1,121 @@
+"""Analyse positions ahead of time into the analysis store main.py reads
+
+Positions come from FEN/EPD files (one per line), PGN files (every position up to --plies) and
+directories of screenshots named after their base32 FEN (saved/ captures, searched with both sides
+to move). They are split over a pool of UCI engines; positions already stored at least as deep
+with as many lines are skipped, so an interrupted run picks up where it stopped.
+
+    python precompute.py openings.pgn saved/ --depth 20 --engines 4 --engine engines/stockfish_14_x64_avx2
+"""
+import argparse
+import base64
+import concurrent.futures
+import glob
+import os
+import shlex
+import sys
+import time
+
+import chess
+import chess.engine
+import chess.pgn
+
+from analysis import AnalysisStore, covers, positionKey
+from engines import EnginePool
+
+def iterPositions(paths, plies):
+    for path in paths:
+        if os.path.isdir(path):
+            for f in sorted(glob.glob(os.path.join(path, "*.png"))):
+                try:
+                    fen = base64.b32decode(os.path.splitext(os.path.basename(f))[0]).decode("ascii")
+                    board = chess.Board(fen)
+                except ValueError:
+                    continue
+                for turn in chess.COLORS:
+                    board.turn = turn
+                    board.castling_rights = chess.BB_CORNERS
+                    board.castling_rights = board.clean_castling_rights()
+                    yield board.copy()
+        elif path.lower().endswith(".pgn"):
+            with open(path) as f:
+                while (game := chess.pgn.read_game(f)) is not None:
+                    board = game.board()
+                    yield board.copy()
+                    for move in list(game.mainline_moves())[:plies]:
+                        board.push(move)
+                        yield board.copy()
+        else:
+            with open(path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        yield chess.Board(line.strip())
+                    except ValueError:
+                        try:
+                            yield chess.Board.from_epd(line.strip())[0]
+                        except ValueError:
+                            continue
+
+class Analyser(EnginePool):
+    """Multipv analysis on a pool of UCI engines, one engine per thread"""
+    def __init__(self, command, depth, multipv, workers, threads=1):
+        super().__init__(command, workers, threads)
+        self.depth = depth
+        self.multipv = multipv
+
+    def lines(self, board):
+        """Lines the analysis of board asks for: --multipv, or every legal move if that is 0"""
+        legal = board.legal_moves.count()
+        return min(self.multipv, legal) if self.multipv else legal
+
+    def analyse(self, board):
+        return self.engine().analyse(board, chess.engine.Limit(depth=self.depth), multipv=self.lines(board))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="FEN/EPD files, PGN files or directories of saved captures")
+    parser.add_argument("--store", default="data/analysis.sqlite", help="analysis store shared with main.py")
+    parser.add_argument("--depth", type=int, default=20)
+    parser.add_argument("--multipv", type=int, default=0, help="lines per position (default: all legal moves, as the hover overlay uses)")
+    parser.add_argument("--plies", type=int, default=16, help="positions analysed from the start of every PGN game")
+    parser.add_argument("--engine", default="engines/stockfish_14_x64_avx2", help="UCI engine command")
+    parser.add_argument("--engines", type=int, default=max((os.cpu_count() or 2) // 2, 1), help="number of engine processes")
+    parser.add_argument("--threads", type=int, default=1, help="threads per engine")
+    args = parser.parse_args()
+
+    store = AnalysisStore(args.store)
+    analyser = Analyser(shlex.split(args.engine), args.depth, args.multipv, args.engines, args.threads)
+
+    seen = set()
+    skipped = 0
+    pending = {}
+    for board in iterPositions(args.inputs, args.plies):
+        key = positionKey(board)
+        if key in seen or not board.is_valid() or board.is_game_over():
+            continue
+        seen.add(key)
+        if covers(store.get(board), analyser.lines(board), args.depth):
+            skipped += 1
+            continue
+        pending[analyser.executor.submit(analyser.analyse, board)] = board
+
+    # the store is only written from this thread, sqlite connections stay on the thread that opened them
+    analysed = 0
+    start = time.perf_counter()
+    try:
+        for future in concurrent.futures.as_completed(pending):
+            store.put(pending[future], future.result())
+            analysed += 1
+            if analysed % 100 == 0:
+                print(f"{analysed}/{len(pending)} positions, {analysed / (time.perf_counter() - start):.1f}/s", file=sys.stderr)
+    finally:
+        for future in pending:
+            future.cancel()
+        analyser.close()
+        print(f"{analysed} positions analysed, {skipped} already stored, {len(store)} in {args.store}", file=sys.stderr)
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import os
+import threading
+import time
+
+import chess
+import numpy as np
+
+from inference import MLP
+from tileindex import tileKeys
+
+def loadModel(path):
+    """The exported NumPy model (see inference.py) or the pickled MLPClassifier"""
+    if path.endswith(".npz"):
+        return MLP(path)
+    # joblib and the unpickled scikit-learn take over a second to import
+    from joblib import load
+    return load(path)
+
+model_path = "models/clf.npz" if os.path.exists("models/clf.npz") else "models/clf.joblib"
+clf = None
+model_mtime = None
+model_lock = threading.Lock()
+
+def getModel():
+    """The classifier, loaded on first use unless preloadModel already did"""
+    global clf, model_mtime
+    with model_lock:
+        if clf is None:
+            model_mtime = os.stat(model_path).st_mtime
+            clf = loadModel(model_path)
+    return clf
+
+def reloadModel():
+    """Load the model again if train.py replaced it since it was loaded, returns whether it did"""
+    global clf, model_mtime
+    try:
+        mtime = os.stat(model_path).st_mtime
+    except OSError:
+        return False
+    if clf is None or mtime == model_mtime:
+        return False
+    with model_lock:
+        clf = loadModel(model_path)
+        model_mtime = mtime
+    print(f"reloaded {model_path}")
+    return True
+
+def labels2board(y, is_white):
+    """Build a board from the 64 predicted piece symbols (A1,B1...H8 as seen from white)"""
+    if not is_white:
+        y = np.flip(y)
+    board = chess.Board()
+    board.clear_board()
+    for sqi, psymbol in enumerate(y):
+        if psymbol != " ":
+            board.set_piece_at(sqi, chess.Piece.from_symbol(psymbol))
+    return board
+
+def predictBoard(tiles, is_white):
+    X = tiles.reshape([64, 1024])
+    y = getModel().predict(X)
+    return labels2board(y, is_white)
+
+def classifyTiles(X, index=None, learn_threshold=0.99):
+    """Labels and confidences of flattened tiles (n, 1024)
+
+    With a tileindex.TileIndex, tiles seen before are looked up (confidence 1) and only the others
+    go to the classifier; those it labels with at least learn_threshold confidence are added."""
+    clf = getModel()
+    labels = np.empty(len(X), dtype=clf.classes_.dtype)
+    confidence = np.ones(len(X))
+    unknown = np.ones(len(X), dtype=bool)
+    if index is not None:
+        keys = tileKeys(X)
+        known = index.lookup(keys)
+        unknown = np.array([label is None for label in known])
+        labels[~unknown] = [label for label in known if label is not None]
+    if unknown.any():
+        proba = clf.predict_proba(X[unknown])
+        labels[unknown] = clf.classes_[proba.argmax(1)]
+        confidence[unknown] = proba.max(1)
+        if index is not None:
+            learn = np.flatnonzero(unknown)[proba.max(1) >= learn_threshold]
+            index.add([keys[i] for i in learn], labels[learn], learned=True)
+    return labels, confidence
+
+def classifyBoards(tiles_list, index=None):
+    """Labels and confidences of the 64 squares of several boards, classified in one batch"""
+    if not tiles_list:
+        return []
+    labels, confidence = classifyTiles(np.concatenate([tiles.reshape([64, 1024]) for tiles in tiles_list]), index)
+    return list(zip(labels.reshape([-1, 64]), confidence.reshape([-1, 64])))
+
+def guessOrientation(labels):
+    """True if white plays up the screen: the white pieces sit lower on average than the black ones"""
+    rows = np.arange(64) // 8
+    white = rows[np.char.isupper(labels.astype(str))]
+    black = rows[np.char.islower(labels.astype(str))]
+    if len(white) == 0 or len(black) == 0:
+        return True
+    return bool(white.mean() <= black.mean())
+
+def isPlausible(labels):
+    """Exactly one king per side and no pawns on the back ranks (holds for either orientation)"""
+    back_ranks = np.concatenate([labels[:8], labels[56:]])
+    return (np.count_nonzero(labels == "K") == 1 and np.count_nonzero(labels == "k") == 1
+            and not np.isin(back_ranks, ["P", "p"]).any())
+
+class BoardStabilizer():
+    """Filters the per-square labels so single misreads do not replace the board
+
+    Squares classified below threshold keep their previous label until the same new label was
+    read for persist_frames. A change is committed right away if the resulting position is
+    plausible, otherwise only after it persisted for persist_frames."""
+    def __init__(self, threshold=0.9, persist_frames=3):
+        self.threshold = threshold
+        self.persist_frames = persist_frames
+        self.labels = None
+        self.candidate = None
+        self.candidate_frames = 0
+        # per square, the label read last frame and for how many frames in a row it differed below threshold
+        self.low_labels = None
+        self.low_frames = np.zeros(64, dtype=int)
+
+        self.commits = 0
+        self.squares_held = 0
+        self.frames_held = 0
+
+    def update(self, labels, confidence):
+        """Returns the committed labels and whether they changed"""
+        if self.labels is None:
+            self.labels = labels.copy()
+            self.low_labels = labels.copy()
+            self.commits += 1
+            return self.labels, True
+
+        proposal = labels.copy()
+        disagree = (confidence < self.threshold) & (labels != self.labels)
+        repeated = disagree & (labels == self.low_labels)
+        self.low_frames = np.where(repeated, self.low_frames + 1, disagree.astype(int))
+        self.low_labels = labels.copy()
+        held = disagree & (self.low_frames < self.persist_frames)
+        proposal[held] = self.labels[held]
+        self.squares_held += int(np.count_nonzero(held))
+
+        if np.array_equal(proposal, self.labels):
+            self.candidate = None
+            self.candidate_frames = 0
+            return self.labels, False
+
+        if self.candidate is not None and np.array_equal(proposal, self.candidate):
+            self.candidate_frames += 1
+        else:
+            self.candidate = proposal
+            self.candidate_frames = 1
+
+        if isPlausible(proposal) or self.candidate_frames >= self.persist_frames:
+            self.labels = proposal
+            self.candidate = None
+            self.candidate_frames = 0
+            self.commits += 1
+            return self.labels, True
+        self.frames_held += 1
+        return self.labels, False
+
+def fingerprint(tiles):
+    """Downsample 32x32 tiles to 8x8 block means, cheap to compare between frames"""
+    return tiles.reshape([-1, 8, 4, 8, 4]).mean((2, 4))
+
+class TilePredictor():
+    """predictBoard that only reclassifies the squares whose tile changed since the last frame
+
+    A square is reclassified when any 4x4 block mean of its tile moved by more than threshold
+    since it was last classified, every other square keeps its previous label. The classifier
+    confidence of every square is kept in self.confidence, and with a BoardStabilizer the board
+    only follows the labels it commits. Every reload_interval seconds it checks whether the model
+    file was replaced, and reclassifies every square with the new model if it was. With a
+    tileindex.TileIndex the changed tiles are looked up first (see classifyTiles), and the labels
+    the index learned from the old model are dropped on a reload."""
+    def __init__(self, threshold=8.0, stabilizer=None, reload_interval=2.0, index=None):
+        self.threshold = threshold
+        self.stabilizer = stabilizer
+        self.index = index
+        self.reload_interval = reload_interval
+        self.reload_checked = time.monotonic()
+        self.fingerprints = None
+        self.labels = None
+        self.confidence = None
+        self.board = None
+        self.is_white = None
+
+        self.frames = 0
+        self.frames_skipped = 0
+        self.tiles_classified = 0
+        self.tiles_reused = 0
+
+    def predictBoard(self, tiles, is_white):
+        if self.reload_interval and time.monotonic() - self.reload_checked > self.reload_interval:
+            self.reload_checked = time.monotonic()
+            if reloadModel():
+                self.fingerprints = None
+                if self.index is not None:
+                    self.index.forget()
+        clf = getModel()
+        fp = fingerprint(tiles)
+        if self.fingerprints is None:
+            self.fingerprints = fp
+            self.labels = np.empty(64, dtype=clf.classes_.dtype)
+            self.confidence = np.zeros(64)
+            changed = np.ones(64, dtype=bool)
+        else:
+            changed = np.abs(fp - self.fingerprints).max((1, 2)) > self.threshold
+
+        self.frames += 1
+        n_changed = int(np.count_nonzero(changed))
+        self.tiles_classified += n_changed
+        self.tiles_reused += 64 - n_changed
+
+        if n_changed == 0:
+            self.frames_skipped += 1
+        else:
+            X = tiles.reshape([64, 1024])[changed]
+            self.labels[changed], self.confidence[changed] = classifyTiles(X, self.index)
+            self.fingerprints[changed] = fp[changed]
+
+        labels, labels_changed = self.labels, n_changed > 0
+        if self.stabilizer:
+            labels, labels_changed = self.stabilizer.update(self.labels, self.confidence)
+
+        if labels_changed or is_white != self.is_white:
+            self.board = labels2board(labels, is_white)
+            self.is_white = is_white
+        return self.board.copy()
+
+    def stats(self):
+        stats = {
+            "frames": self.frames,
+            "frames_skipped": self.frames_skipped,
+            "tiles_classified": self.tiles_classified,
+            "tiles_reused": self.tiles_reused,
+            "min_confidence": float(self.confidence.min()) if self.confidence is not None else None,
+        }
+        if self.index is not None:
+            stats["index_hit_rate"] = self.index.stats()["hit_rate"]
+        if self.stabilizer:
+            stats["commits"] = self.stabilizer.commits
+            stats["squares_held"] = self.stabilizer.squares_held
+            stats["frames_held"] = self.stabilizer.frames_held
+        return stats
@@ -0,0 +1,112 @@
+import chess
+
+import predict
+from analysis import analysisDepth
+
+def overlap(a, b):
+    """Intersection over union of two (x0, y0, x1, y1) rects"""
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+class TrackedBoard():
+    """One board on screen, its id stays the same while it is detected at about the same place"""
+    def __init__(self, id, rect):
+        self.id = id
+        self.rect = rect
+        self.stabilizer = predict.BoardStabilizer()
+        self.labels = None
+        self.board = None
+        self.is_white = True
+        # set by flip(), the orientation is the opposite of the guessed one
+        self.flipped = False
+        self.missing = 0
+
+    def update(self, rect, labels, confidence):
+        self.rect = rect
+        self.missing = 0
+        self.labels, changed = self.stabilizer.update(labels, confidence)
+        if changed or self.board is None:
+            self.is_white = predict.guessOrientation(self.labels) != self.flipped
+            self.board = predict.labels2board(self.labels, self.is_white)
+
+    def flip(self):
+        """Override the guessed orientation (the f key)"""
+        self.flipped = not self.flipped
+        self.is_white = not self.is_white
+        if self.labels is not None:
+            self.board = predict.labels2board(self.labels, self.is_white)
+
+class BoardSession():
+    """The boards seen over the frames, e.g. several games spectated side by side
+
+    The tiles of every board detected in a frame are classified in one batch (looked up in index
+    first, see predict.classifyTiles). A detection
+    continues the tracked board it overlaps most (at least min_overlap), anything else starts a
+    new board; boards missing for max_missing frames are dropped."""
+    def __init__(self, min_overlap=0.5, max_missing=30, index=None):
+        self.index = index
+        self.min_overlap = min_overlap
+        self.max_missing = max_missing
+        self.boards = {}
+        self.next_id = 1
+        # id -> (position analysed by the board's own search, depth last put in the cache)
+        self.searches = {}
+
+    def update(self, detections):
+        """Returns the boards sorted by id"""
+        results = predict.classifyBoards([detection.tiles for detection in detections], self.index)
+        pairs = sorted(((overlap(board.rect, detection.rect), board.id, i)
+                        for board in self.boards.values() for i, detection in enumerate(detections)), reverse=True)
+        matched = {}
+        for score, id, i in pairs:
+            if score >= self.min_overlap and id not in matched.values() and i not in matched:
+                matched[i] = id
+
+        for i, detection in enumerate(detections):
+            if i not in matched:
+                matched[i] = self.next_id
+                self.boards[self.next_id] = TrackedBoard(self.next_id, detection.rect)
+                self.next_id += 1
+            self.boards[matched[i]].update(detection.rect, *results[i])
+
+        for id, board in list(self.boards.items()):
+            if id not in matched.values():
+                board.missing += 1
+                if board.missing > self.max_missing:
+                    del self.boards[id]
+        return [self.boards[id] for id in sorted(self.boards)]
+
+    def analyse(self, engines, cache, focus=None):
+        """Keep one engine search per board (except focus, which the main searches cover) and
+        its lines in cache, so they show up as soon as the board gets the focus
+
+        A board only gets a search while the engines have a thread to spare for it
+        (EngineManager.spare), the others wait until a search is removed."""
+        for id, (position, depth) in list(self.searches.items()):
+            name = f"board{id}"
+            multipv = engines.multipv(name)
+            if analysisDepth(multipv) > depth:
+                cache.put(position, multipv)
+                self.searches[id] = (position, analysisDepth(multipv))
+            if id not in self.boards or id == focus:
+                engines.remove(name)
+                del self.searches[id]
+        for id, tracked in self.boards.items():
+            name = f"board{id}"
+            if id == focus or tracked.board is None:
+                continue
+            position = tracked.board.copy()
+            position.turn = chess.WHITE if tracked.is_white else chess.BLACK
+            position.castling_rights = position.clean_castling_rights()
+            if not position.is_valid() or (id in self.searches and self.searches[id][0] == position):
+                continue
+            if id not in self.searches:
+                if not engines.spare():
+                    continue
+                engines.add(name)
+            engines.analyse(name, position)
+            self.searches[id] = (position, 0)
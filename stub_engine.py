@@ -0,0 +1,96 @@
+"""Minimal UCI engine for running the analysis code without Stockfish
+
+Every depth iteration scores the legal moves by the material balance after the move (with a
+small deterministic tie break) and reports the best MultiPV of them as one move lines.
+
+    python main.py --engine "python stub_engine.py"
+"""
+import queue
+import sys
+import threading
+import time
+
+import chess
+
+values = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+def material(board, color):
+    return sum(values[piece.piece_type] * (1 if piece.color == color else -1) for piece in board.piece_map().values())
+
+def scoreMoves(board):
+    scored = []
+    for move in board.legal_moves:
+        board.push(move)
+        score = material(board, not board.turn) + (move.to_square * 7 + move.from_square) % 11
+        board.pop()
+        scored.append((score, move))
+    scored.sort(key=lambda s: -s[0])
+    return scored
+
+def send(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+def search(board, depth, multipv, stop):
+    started = time.perf_counter()
+    scored = scoreMoves(board)
+    if not scored:
+        send("info depth 0 score " + ("mate 0" if board.is_checkmate() else "cp 0"))
+        send("bestmove (none)")
+        return
+    nodes = 0
+    for d in range(1, depth+1):
+        if stop.wait(0.005 * d):
+            break
+        nodes += len(scored) * d
+        elapsed = int((time.perf_counter() - started) * 1000)
+        for k, (score, move) in enumerate(scored[:multipv]):
+            send(f"info depth {d} seldepth {d} multipv {k+1} score cp {score} nodes {nodes} nps {nodes * 1000 // max(elapsed, 1)} time {elapsed} pv {move.uci()}")
+    send(f"bestmove {scored[0][1].uci()}")
+
+def main():
+    commands = queue.Queue()
+    threading.Thread(target=lambda: [commands.put(line.strip()) for line in sys.stdin], daemon=True).start()
+
+    board = chess.Board()
+    options = {"MultiPV": 1}
+    worker = None
+    stop = threading.Event()
+
+    while True:
+        line = commands.get()
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == "uci":
+            send("id name stub")
+            send("option name Threads type spin default 1 min 1 max 512")
+            send("option name Hash type spin default 16 min 1 max 33554432")
+            send("option name MultiPV type spin default 1 min 1 max 500")
+            send("uciok")
+        elif tokens[0] == "isready":
+            send("readyok")
+        elif tokens[0] == "setoption" and "value" in tokens:
+            name = " ".join(tokens[2:tokens.index("value")])
+            if name == "MultiPV":
+                options[name] = int(tokens[-1])
+        elif tokens[0] == "position":
+            moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+            board = chess.Board() if tokens[1] == "startpos" else chess.Board(" ".join(tokens[2:moves]))
+            for move in tokens[moves+1:]:
+                board.push_uci(move)
+        elif tokens[0] == "go":
+            depth = int(tokens[tokens.index("depth")+1]) if "depth" in tokens else 245
+            stop = threading.Event()
+            worker = threading.Thread(target=search, args=(board.copy(), depth, options["MultiPV"], stop))
+            worker.start()
+        elif tokens[0] == "stop":
+            stop.set()
+            if worker:
+                worker.join()
+        elif tokens[0] == "quit":
+            stop.set()
+            break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Exact-match lookup of tiles that were seen before
+
+Sites draw the pieces from a fixed set of sprites, so the same resized tile comes up again and
+again. The index maps a hash of the tile, quantised to 16 grey levels, to its label. It is built
+from the training tiles (python tileindex.py) and grows with the tiles the classifier labels
+confidently while running; only tiles it has not seen go to the classifier. Labels learned from
+the classifier are dropped when the model is replaced, so the new model gets to label them again.
+"""
+import collections
+import hashlib
+import os
+
+import numpy as np
+
+index_path = "models/tiles.npz"
+
+def tileKeys(X):
+    """64 bit keys of flattened tiles (n, 1024) with values 0..255"""
+    q = (np.asarray(X, dtype=np.uint8) >> 4).reshape(len(X), -1)
+    return [int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), "little") for row in q]
+
+class TileIndex():
+    """Bounded LRU dict from tile key to label, persisted as an .npz next to the model
+
+    A key that comes up with two different labels is ambiguous and dropped for good."""
+    def __init__(self, maxsize=200000, path=index_path):
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.ambiguous = set()
+        # keys labelled by the classifier rather than from the training images
+        self.learned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def load(cls, maxsize=200000, path=index_path):
+        index = cls(maxsize, path)
+        if os.path.exists(path):
+            with np.load(path) as f:
+                index.entries.update(zip(f["keys"].tolist(), f["labels"].tolist()))
+                index.ambiguous.update(f["ambiguous"].tolist())
+                if "learned" in f:
+                    index.learned.update(f["learned"].tolist())
+        return index
+
+    def save(self):
+        keys = np.fromiter(self.entries.keys(), dtype=np.uint64, count=len(self.entries))
+        labels = np.array(list(self.entries.values()), dtype="U1")
+        ambiguous = np.fromiter(self.ambiguous, dtype=np.uint64, count=len(self.ambiguous))
+        learned = np.fromiter(self.learned, dtype=np.uint64, count=len(self.learned))
+        with open(self.path + ".tmp", "wb") as f:
+            np.savez(f, keys=keys, labels=labels, ambiguous=ambiguous, learned=learned)
+        os.replace(self.path + ".tmp", self.path)
+
+    def lookup(self, keys):
+        """Label of every key, None where it is not in the index"""
+        labels = []
+        for key in keys:
+            label = self.entries.get(key)
+            if label is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            labels.append(label)
+        return labels
+
+    def add(self, keys, labels, learned=False):
+        """Add labelled keys, learned if the labels come from the classifier"""
+        for key, label in zip(keys, labels):
+            if key in self.ambiguous:
+                continue
+            known = self.entries.get(key)
+            if known is not None and known != label:
+                del self.entries[key]
+                self.learned.discard(key)
+                self.ambiguous.add(key)
+                continue
+            if learned and known is None:
+                self.learned.add(key)
+            elif not learned:
+                self.learned.discard(key)
+            self.entries[key] = label
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            key, _ = self.entries.popitem(last=False)
+            self.learned.discard(key)
+            self.evictions += 1
+
+    def forget(self):
+        """Drop the labels learned from the classifier, e.g. after the model was replaced"""
+        for key in self.learned:
+            del self.entries[key]
+        self.learned.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+        }
+
+if __name__ == "__main__":
+    import argparse
+
+    from tilestore import TileStore
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default="data/tiles", help="tile store built by train.py")
+    parser.add_argument("--maxsize", type=int, default=200000)
+    args = parser.parse_args()
+
+    index = TileIndex.load(args.maxsize)
+    X, y = TileStore(args.store).arrays()
+    for start in range(0, len(y), 65536):
+        index.add(tileKeys(X[start:start + 65536]), y[start:start + 65536])
+    index.save()
+    print(f"{len(index)} tiles in {index.path}, {len(index.ambiguous)} ambiguous")
@@ -0,0 +1,145 @@
+"""On-disk store of training tiles
+
+Tiles are appended as raw uint8 rows to tiles.u8 (read back through np.memmap), their labels as one
+ascii byte per tile to labels.u8, and index.json maps every source image to its size, mtime, sha1
+and row range. Only new or changed images are extracted again, in a process pool.
+"""
+import base64
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+
+import chess
+import numpy as np
+from PIL import Image
+
+tile_shape = (32, 32)
+
+def fileHash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def fenLabels(path):
+    """Labels of the 64 squares (A1..H8) of an image named after its base32 encoded FEN"""
+    encoded = re.search(r"([a-zA-Z0-9=]*)\.png$", path).group(1)
+    board = chess.Board(base64.b32decode(encoded).decode("ascii"))
+    pieces = [board.piece_at(square) for square in range(64)]
+    return [piece.symbol() if piece != None else " " for piece in pieces]
+
+def extractTiles(path):
+    """(sha1, tiles) of an image, tiles is None when no board is found; runs in a worker process"""
+    import vision
+
+    is_match, tiles = vision.img2tiles(Image.open(path))
+    if not is_match:
+        return fileHash(path), None
+    return fileHash(path), np.rint(tiles).astype(np.uint8)
+
+class TileStore():
+    def __init__(self, path="data/tiles"):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.tiles_path = os.path.join(path, "tiles.u8")
+        self.labels_path = os.path.join(path, "labels.u8")
+        self.index_path = os.path.join(path, "index.json")
+        self.rows = 0
+        self.sources = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.rows = index["rows"]
+            self.sources = index["sources"]
+        # drop rows of an update that was interrupted before its index was written
+        for data_path, row_size in ((self.tiles_path, np.prod(tile_shape)), (self.labels_path, 1)):
+            with open(data_path, "ab") as f:
+                f.truncate(self.rows * row_size)
+
+    def stale(self, path):
+        entry = self.sources.get(path)
+        if entry is None:
+            return True
+        stat = os.stat(path)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return False
+        # touched but possibly identical content
+        if entry["sha1"] == fileHash(path):
+            entry["mtime"] = stat.st_mtime
+            return False
+        return True
+
+    def update(self, paths, labeler=fenLabels, workers=None):
+        """Extract the tiles of new or changed images, forget removed ones; returns (extracted, unmatched)"""
+        paths = sorted(paths)
+        for path in set(self.sources) - set(paths):
+            del self.sources[path]
+        todo = [path for path in paths if self.stale(path)]
+        extracted = unmatched = 0
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor, \
+                open(self.tiles_path, "ab") as tiles_file, open(self.labels_path, "ab") as labels_file:
+            for path, (sha1, tiles) in zip(todo, executor.map(extractTiles, todo, chunksize=8)):
+                stat = os.stat(path)
+                entry = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1, "offset": self.rows, "count": 0}
+                if tiles is None:
+                    unmatched += 1
+                else:
+                    tiles_file.write(tiles.tobytes())
+                    labels_file.write("".join(labeler(path)).encode("ascii"))
+                    entry["count"] = len(tiles)
+                    self.rows += len(tiles)
+                    extracted += 1
+                self.sources[path] = entry
+        self.save()
+        if self.rows > 2 * self.live():
+            self.compact()
+        return extracted, unmatched
+
+    def live(self):
+        return sum(entry["count"] for entry in self.sources.values())
+
+    def save(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"rows": self.rows, "sources": self.sources}, f)
+        os.replace(tmp, self.index_path)
+
+    def memmaps(self):
+        if self.rows == 0:
+            return np.empty((0,) + tile_shape, np.uint8), np.empty(0, np.uint8)
+        tiles = np.memmap(self.tiles_path, np.uint8, "r", shape=(self.rows,) + tile_shape)
+        labels = np.memmap(self.labels_path, np.uint8, "r", shape=(self.rows,))
+        return tiles, labels
+
+    def rowMask(self, sources=None):
+        mask = np.zeros(self.rows, bool)
+        for path, entry in self.sources.items():
+            if sources is None or path in sources:
+                mask[entry["offset"]:entry["offset"] + entry["count"]] = True
+        return mask
+
+    def arrays(self, sources=None):
+        """(X, y) of the stored tiles, X is a uint8 memmap of flattened tiles when no rows are stale"""
+        tiles, labels = self.memmaps()
+        mask = self.rowMask(sources)
+        if not mask.all():
+            tiles, labels = tiles[mask], labels[mask]
+        y = labels.view("S1").astype(str)
+        return tiles.reshape(-1, tile_shape[0] * tile_shape[1]), y
+
+    def compact(self):
+        """Rewrite the data files without the rows of changed or removed images"""
+        tiles, labels = self.memmaps()
+        offset = 0
+        with open(self.tiles_path + ".tmp", "wb") as tiles_file, open(self.labels_path + ".tmp", "wb") as labels_file:
+            for entry in sorted(self.sources.values(), key=lambda entry: entry["offset"]):
+                rows = slice(entry["offset"], entry["offset"] + entry["count"])
+                tiles_file.write(tiles[rows].tobytes())
+                labels_file.write(labels[rows].tobytes())
+                entry["offset"] = offset
+                offset += entry["count"]
+        del tiles, labels
+        os.replace(self.tiles_path + ".tmp", self.tiles_path)
+        os.replace(self.labels_path + ".tmp", self.labels_path)
+        self.rows = offset
+        self.save()
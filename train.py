@@ -1,36 +1,107 @@
-import base64
+import argparse
 import glob
-import re
+import json
+import os
 
-import chess
 import numpy as np
 from joblib import dump, load
-from PIL import Image, ImageGrab
 from sklearn.neural_network import MLPClassifier
 
-import vision
+from inference import exportModel
+from tilestore import TileStore
+
+model_path = "models/clf.joblib"
+# what main.py loads, see inference.py
+npz_path = "models/clf.npz"
+# sha1 of every source image the current model was trained on
+trained_path = "models/clf.trained.json"
+
+def isHeldOut(sha1, holdout):
+    """Deterministic validation split on the source image hash"""
+    return int(sha1[:8], 16) % 1000 < holdout * 1000
+
+def saveModel(clf, trained):
+    """Replace the model atomically, a running main.py picks it up from the file's mtime"""
+    dump(clf, model_path + ".tmp")
+    os.replace(model_path + ".tmp", model_path)
+    exportModel(clf, npz_path + ".tmp")
+    os.replace(npz_path + ".tmp", npz_path)
+    with open(trained_path + ".tmp", "w") as f:
+        json.dump(sorted(trained), f)
+    os.replace(trained_path + ".tmp", trained_path)
+
+def loadTrained(store, images_dir):
+    if os.path.exists(trained_path):
+        with open(trained_path) as f:
+            return set(json.load(f))
+    # a model from a full fit before this file existed was trained on images/
+    return {entry["sha1"] for path, entry in store.sources.items() if path.startswith(images_dir)}
+
+def score(clf, X, y):
+    return clf.score(np.asarray(X, dtype=np.float32), y) if len(y) else None
 
 if __name__ == "__main__":
-    images_dirs = sorted(glob.glob("images/*.png"))
-    images = [Image.open(f) for f in images_dirs]
-    images_tiles = []
-    for image in images:
-        is_match, tiles = vision.img2tiles(image)
-        if is_match:
-            images_tiles.append(tiles)
-    X = np.array(images_tiles).reshape([-1, 1024])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default="images", help="directory of screenshots named after their base32 FEN")
+    parser.add_argument("--captures", default="saved", help="positions saved from main.py with the p key")
+    parser.add_argument("--store", default="data/tiles", help="tile store, only new or changed images are extracted")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes (default: all cores)")
+    parser.add_argument("--holdout", type=float, default=None,
+                        help="fraction of images kept for validation (default: 0.1 in incremental mode, none for a full fit)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="update the current model with partial_fit on the images it was not trained on yet")
+    parser.add_argument("--epochs", type=int, default=10, help="passes over the new tiles in incremental mode")
+    parser.add_argument("--replay", type=float, default=1.0,
+                        help="already trained tiles mixed in per new tile in incremental mode, against forgetting")
+    parser.add_argument("--tolerance", type=float, default=0.002,
+                        help="largest validation accuracy drop for which the updated model is still kept")
+    args = parser.parse_args()
 
-    fens = [re.search(r"images/([a-zA-Z0-9=]*).png", f).group(1) for f in images_dirs]
-    fens = [base64.b32decode(f).decode("ascii") for f in fens]
-    boards = [chess.Board(f) for f in fens]
-    pieces = [board.piece_at(square) for board in boards for square in range(64)]
-    pieces = [piece.symbol() if piece != None else " " for piece in pieces]
-    y = np.array(pieces)
+    store = TileStore(args.store)
+    paths = glob.glob(f"{args.images}/*.png") + glob.glob(f"{args.captures}/*.png")
+    extracted, unmatched = store.update(paths, workers=args.workers)
+    print(f"extracted {extracted} images ({unmatched} without a board), {store.live()} tiles stored")
 
-    clf = MLPClassifier(max_iter=1000)
-    clf.fit(X, y)
-    print(clf.score(X, y))
+    fraction = args.holdout if args.holdout is not None else (0.1 if args.incremental else 0)
+    # images the current model was trained on would flatter it, they are never held out in incremental mode
+    trained = loadTrained(store, args.images) if args.incremental else set()
+    holdout = {path for path, entry in store.sources.items()
+               if isHeldOut(entry["sha1"], fraction) and entry["sha1"] not in trained}
+    X_val, y_val = store.arrays(holdout)
 
+    if not args.incremental:
+        # the full fit is on every image in --images as before, captures are added by the incremental mode
+        train = {path for path in store.sources if path.startswith(args.images) and path not in holdout}
+        X, y = store.arrays(train)
+        # MLPClassifier keeps float32 input as float32, half the memory of the default float64
+        X = np.asarray(X, dtype=np.float32)
+        clf = MLPClassifier(max_iter=1000)
+        clf.fit(X, y)
+        print(f"train {clf.score(X, y)} validation {score(clf, X_val, y_val)}")
+        saveModel(clf, {store.sources[path]["sha1"] for path in train})
+    else:
+        clf = load(model_path)
+        new = {path for path, entry in store.sources.items() if entry["sha1"] not in trained and path not in holdout}
+        X_new, y_new = store.arrays(new)
+        if len(y_new) == 0:
+            print("no new images")
+            raise SystemExit
+        X_old, y_old = store.arrays({path for path, entry in store.sources.items() if entry["sha1"] in trained})
+        rng = np.random.default_rng()
+        replay = rng.choice(len(y_old), min(int(len(y_new) * args.replay), len(y_old)), replace=False)
+        replay.sort()
+        X = np.concatenate([np.asarray(X_new, dtype=np.float32), np.asarray(X_old[replay], dtype=np.float32)])
+        y = np.concatenate([y_new, y_old[replay]])
 
-    dump(clf, "models/clf.joblib")
+        before = score(clf, X_val, y_val)
+        for epoch in range(args.epochs):
+            order = rng.permutation(len(y))
+            for batch in np.array_split(order, max(len(y) // 200, 1)):
+                clf.partial_fit(X[batch], y[batch])
+        after = score(clf, X_val, y_val)
+        print(f"{len(y_new)} new tiles, validation {before} -> {after}")
 
+        if before is not None and after < before - args.tolerance:
+            print("validation accuracy dropped, keeping the current model")
+        else:
+            saveModel(clf, trained | {store.sources[path]["sha1"] for path in new})
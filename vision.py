@@ -1,12 +1,9 @@
+import collections
 import glob
 import os
 
 import numpy as np
 from PIL import Image
-from scipy import signal
-
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
-import tensorflow as tf
 
 # def display_array(a, rng=[0,1]):
 #     a = (a - rng[0])/float(rng[1] - rng[0])*255
@@ -14,11 +11,22 @@ import tensorflow as tf
 #     img = Image.fromarray(a, "L")
 #     display(img)
 
+# TensorFlow is an optional backend, only imported the first time it is selected
+tf = None
+
+def import_tf():
+  """Import TensorFlow on demand"""
+  global tf
+  if tf is None:
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    import tensorflow
+    tf = tensorflow
+  return tf
+
 def make_mask(a):
   """Transform a 2D array into a convolution kernel"""
-  a = np.asarray(a)
-  a = a.reshape([*a.shape, 1, 1])
-  return tf.constant(a, dtype=1)
+  a = np.asarray(a, dtype=np.float32)
+  return a.reshape([*a.shape, 1, 1])
 
 x_mask = make_mask([[-1.0, 0.0, 1.0],
                     [-1.0, 0.0, 1.0],
@@ -31,7 +39,7 @@ y_mask = make_mask([[-1.0,-1.0,-1.0],
 def simple_conv(x, k):
   """A simplified 2D convolution operation"""
   x = tf.expand_dims(tf.expand_dims(x, 0), -1)
-  y = tf.nn.depthwise_conv2d(x, k, [1, 1, 1, 1], padding='SAME')
+  y = tf.nn.depthwise_conv2d(x, tf.constant(k), [1, 1, 1, 1], padding='SAME')
   return y[0, :, :, 0]
 
 def gradientx(x):
@@ -42,186 +50,408 @@ def gradienty(x):
   """Compute the x gradient of an array"""
   return simple_conv(x, y_mask)
 
-def checkMatch(lineset):
-    """Checks whether there exists 7 lines of consistent increasing order in set of lines"""
-    linediff = np.diff(lineset)
-    x = 0
-    cnt = 0
-    for line in linediff:
-        # Within 5 px of the other (allowing for minor image errors)
-        if np.abs(line - x) < 5:
-            cnt += 1
-        else:
-            cnt = 0
-            x = line
-    return cnt == 5
-
-def pruneLines(lineset):
-    """Prunes a set of lines to 7 in consistent increasing order (chessboard)"""
-    linediff = np.diff(lineset)
-    x = 0
-    cnt = 0
-    start_pos = 0
-    for i, line in enumerate(linediff):
-        # Within 5 px of the other (allowing for minor image errors)
-        if np.abs(line - x) < 5:
-            cnt += 1
-            if cnt == 5:
-                end_pos = i+2
-                return lineset[start_pos:end_pos]
-        else:
-            cnt = 0
-            x = line
-            start_pos = i
-    return lineset
+def hough_tf(a):
+    """Returns the x and y gradient projections of a float32 grayscale array using TensorFlow"""
+    import_tf()
+    A = tf.Variable(a)
+    Dx = gradientx(A)
+    Dy = gradienty(A)
+    Dx_pos = tf.clip_by_value(Dx,    0.0, 255.0)
+    Dx_neg = tf.clip_by_value(Dx, -255.0,   0.0)
+    Dy_pos = tf.clip_by_value(Dy,    0.0, 255.0)
+    Dy_neg = tf.clip_by_value(Dy, -255.0,   0.0)
+    hough_Dx = tf.reduce_sum(Dx_pos, 0) * tf.reduce_sum(-Dx_neg, 0) / (a.shape[0]*a.shape[0])
+    hough_Dy = tf.reduce_sum(Dy_pos, 1) * tf.reduce_sum(-Dy_neg, 1) / (a.shape[1]*a.shape[1])
+    return hough_Dx.numpy(), hough_Dy.numpy()
+
+def projectGradient(grad, axis, buf):
+    """Product of the summed positive and negative gradient along axis (clipped to 255), normalized"""
+    n = np.float32(grad.shape[axis])
+    pos = np.clip(grad, 0.0, 255.0, out=buf).sum(axis)
+    neg = np.clip(grad, -255.0, 0.0, out=buf).sum(axis)
+    neg *= -1
+    return pos * neg / (n*n)
+
+def box_gradient(a, box, out):
+    """x gradient of the 3x3 masks into out (pass transposed views for y), box is scratch space
+
+    The masks are separable: a 3-tap box sum across the gradient followed by a central
+    difference along it, both with the zero padding of padding='SAME'."""
+    # sum 3 rows, then difference of the columns either side
+    np.copyto(box, a)
+    box[1:] += a[:-1]
+    box[:-1] += a[1:]
+    np.subtract(box[:, 2:], box[:, :-2], out=out[:, 1:-1])
+    out[:, 0] = box[:, 1]
+    np.negative(box[:, -2], out=out[:, -1])
+
+def hough_numpy(a):
+    """Returns the x and y gradient projections of a float32 grayscale array, same as hough_tf"""
+    box = np.empty_like(a)
+    grad = np.empty_like(a)
+    box_gradient(a, box, grad)
+    hough_Dx = projectGradient(grad, 0, box)
+    box_gradient(a.T, box.T, grad.T)
+    hough_Dy = projectGradient(grad, 1, box)
+    return hough_Dx, hough_Dy
+
+hough_backends = {
+    "numpy": hough_numpy,
+    "tensorflow": hough_tf,
+}
 
 def skeletonize_1d(arr):
     """return skeletonized 1d array (thin to single value, favor to the right)"""
-    _arr = arr.copy() # create a copy of array to modify without destroying original
-    # Go forwards
-    for i in range(_arr.size-1):
-        # Will right-shift if they are the same
-        if arr[i] <= _arr[i+1]:
-            _arr[i] = 0
-
-    # Go reverse
-    for i in np.arange(_arr.size-1, 0,-1):
-        if _arr[i-1] > _arr[i]:
-            _arr[i] = 0
+    # Going forwards a value is dropped if the next one is at least as large (right-shift on ties)
+    forward = arr.copy()
+    forward[:-1][arr[:-1] <= arr[1:]] = 0
+    # Going in reverse a value is dropped if the one before it is larger after the forward pass
+    _arr = forward.copy()
+    _arr[1:][forward[:-1] > forward[1:]] = 0
     return _arr
 
+def gaussian(m, std):
+    """scipy.signal.windows.gaussian, without importing scipy.signal (about a second at startup)"""
+    n = np.arange(m) - (m - 1) / 2
+    return np.exp(-0.5 * (n / std) ** 2)
+
+gausswin = gaussian(21, 4)
+gausswin /= np.sum(gausswin)
+
+def fitLattice(lines, tolerance=3, min_step=8, window=16):
+    """Fits 7 equally spaced lines to a sorted set of candidate lines, returns (lines, matched, quality)
+
+    Every candidate line is tried as the first line, with the period of each of the next window
+    candidates being the 2nd to 7th line, so all lattices through two nearby candidates are
+    scored at once. A lattice line is matched by the nearest candidate within tolerance px, stray
+    candidates in between do not matter. The lattice is scored with the board edges one step
+    outside it, 9 lines: the best one matches all 7 inner lines, then the most of the 9 with the
+    smallest error (an outer edge that became a candidate would otherwise pass for the first
+    line), then is the widest (a row of toolbar icons is smaller than the board), then the
+    leftmost. quality is matched/7 of the inner lines scaled down by up to half for their mean error."""
+    n = len(lines)
+    if n < 2:
+        return lines, 0, 0.0
+    # pairs of a candidate and one of the next window ones, O(n * window) rather than O(n^2)
+    i = np.repeat(np.arange(n), window)
+    j = i + np.tile(np.arange(1, window + 1), n)
+    i, j = i[j < n], j[j < n]
+    k = np.arange(1, 7)
+    step = ((lines[j] - lines[i])[:, None] / k).ravel()
+    first = np.repeat(lines[i], len(k))
+    valid = step >= min_step
+    step, first = step[valid], first[valid]
+    if len(step) == 0:
+        return lines, 0, 0.0
+
+    predicted = first[:, None] + step[:, None] * np.arange(-1, 8)
+    idx = np.clip(np.searchsorted(lines, predicted), 1, n - 1)
+    left, right = lines[idx - 1], lines[idx]
+    nearest = np.where(predicted - left <= right - predicted, left, right)
+    error = np.abs(nearest - predicted)
+    hit = error <= tolerance
+
+    def score(hit, error, count):
+        matched = hit.sum(1)
+        mean_error = np.where(hit, error, 0).sum(1) / np.maximum(matched, 1)
+        return matched, matched / count * (1 - mean_error / (2 * tolerance))
+    matched, quality = score(hit[:, 1:8], error[:, 1:8], 7)
+    _, quality_edges = score(hit, error, 9)
+
+    best = np.lexsort((first, -step, -quality_edges, -matched))[0]
+    return nearest[best, 1:8], int(matched[best]), float(quality[best])
+
+def candidateLines(hough, thresh):
+    """Peaks of a gradient projection, blurred where there is a strong line (binarize) and skeletonized"""
+    blur = np.convolve(hough > thresh, gausswin, mode="same")
+    return np.where(skeletonize_1d(blur))[0]
+
+def fitChessLines(hdx, hdy, hdx_thresh, hdy_thresh):
+    """getChessLines that also returns the fit quality, the lower of both axes (1.0 is a perfect grid)"""
+    lines_x, matched_x, quality_x = fitLattice(candidateLines(hdx, hdx_thresh)) # vertical lines
+    lines_y, matched_y, quality_y = fitLattice(candidateLines(hdy, hdy_thresh)) # horizontal lines
+
+    is_match = matched_x == 7 and matched_y == 7
+    return lines_x, lines_y, is_match, min(quality_x, quality_y)
+
 def getChessLines(hdx, hdy, hdx_thresh, hdy_thresh):
     """Returns pixel indices for the 7 internal chess lines in x and y axes"""
-    # Blur
-    gausswin = signal.gaussian(21,4)
-    gausswin /= np.sum(gausswin)
-
-    # Blur where there is a strong horizontal or vertical line (binarize)
-    blur_x = np.convolve(hdx > hdx_thresh, gausswin, mode="same")
-    blur_y = np.convolve(hdy > hdy_thresh, gausswin, mode="same")
-
-
-    skel_x = skeletonize_1d(blur_x)
-    skel_y = skeletonize_1d(blur_y)
-
-    # Find points on skeletonized arrays (where returns 1-length tuple)
-    lines_x = np.where(skel_x)[0] # vertical lines
-    lines_y = np.where(skel_y)[0] # horizontal lines
-
-    # Prune inconsistent lines
-    lines_x = pruneLines(lines_x)
-    lines_y = pruneLines(lines_y)
+    lines_x, lines_y, is_match, quality = fitChessLines(hdx, hdy, hdx_thresh, hdy_thresh)
+    return lines_x, lines_y, is_match
 
-    is_match = len(lines_x) == 7 and len(lines_y) == 7 and checkMatch(lines_x) and checkMatch(lines_y)
+def tileIndices(lines, step, size):
+    """Pixel indices (8, step) of every square along one axis, edge-clamped to [0, size)
 
-    return lines_x, lines_y, is_match
+    Squares narrower than step repeat their first pixel, the same as edge padding them on the
+    left (the outer squares are always exactly step wide)."""
+    sets = np.hstack([lines[0]-step, lines, lines[-1]+step])
+    short = np.maximum(step - np.diff(sets), 0)
+    offsets = np.maximum(np.arange(step)[None, :] - short[:, None], 0)
+    return np.clip(sets[:-1, None] + offsets, 0, size-1)
 
 def getChessTiles(a, lines_x, lines_y):
-    """Split up input grayscale array into 64 tiles stacked in a 3D matrix using the chess linesets"""
+    """Split up input grayscale array into 64 tiles stacked in a (64, h, w) array using the chess linesets"""
     # Find average square size, round to a whole pixel for determining edge pieces sizes
     stepx = np.int32(np.round(np.mean(np.diff(lines_x))))
     stepy = np.int32(np.round(np.mean(np.diff(lines_y))))
 
-    # Pad edges as needed to fill out chessboard (for images that are partially over-cropped)
-    padr_x = 0
-    padl_x = 0
-    padr_y = 0
-    padl_y = 0
-
-    if lines_x[0] - stepx < 0:
-        padl_x = np.abs(lines_x[0] - stepx)
-    if lines_x[-1] + stepx > a.shape[1]-1:
-        padr_x = np.abs(lines_x[-1] + stepx - a.shape[1])
-    if lines_y[0] - stepy < 0:
-        padl_y = np.abs(lines_y[0] - stepy)
-    if lines_y[-1] + stepx > a.shape[0]-1:
-        padr_y = np.abs(lines_y[-1] + stepy - a.shape[0])
-
-    # New padded array
-    a2 = np.pad(a, ((padl_y,padr_y),(padl_x,padr_x)), mode="edge")
-
-    setsx = np.hstack([lines_x[0]-stepx, lines_x, lines_x[-1]+stepx]) + padl_x
-    setsy = np.hstack([lines_y[0]-stepy, lines_y, lines_y[-1]+stepy]) + padl_y
-
-    a2 = a2[setsy[0]:setsy[-1], setsx[0]:setsx[-1]]
-    setsx -= setsx[0]
-    setsy -= setsy[0]
-
-    # Matrix to hold images of individual squares (in grayscale)
-    squares = np.zeros([np.round(stepy), np.round(stepx), 64],dtype=np.uint8)
-
-    # For each row
-    for i in range(0,8):
-        # For each column
-        for j in range(0,8):
-            # Vertical lines
-            x1 = setsx[i]
-            x2 = setsx[i+1]
-            padr_x = 0
-            padl_x = 0
-            padr_y = 0
-            padl_y = 0
-
-            if (x2-x1) > stepx:
-                if i == 7:
-                    x1 = x2 - stepx
-                else:
-                    x2 = x1 + stepx
-            elif (x2-x1) < stepx:
-                if i == 7:
-                    # right side, pad right
-                    padr_x = stepx-(x2-x1)
-                else:
-                    # left side, pad left
-                    padl_x = stepx-(x2-x1)
-            # Horizontal lines
-            y1 = setsy[j]
-            y2 = setsy[j+1]
-
-            if (y2-y1) > stepy:
-                if j == 7:
-                    y1 = y2 - stepy
-                else:
-                    y2 = y1 + stepy
-            elif (y2-y1) < stepy:
-                if j == 7:
-                    # right side, pad right
-                    padr_y = stepy-(y2-y1)
-                else:
-                    # left side, pad left
-                    padl_y = stepy-(y2-y1)
-            # slicing a, rows sliced with horizontal lines, cols by vertical lines so reversed
-            # Also, change order so its A1,B1...H8 for a white-aligned board
-            # Apply padding as defined previously to fit minor pixel offsets
-            squares[:,:,(7-j)*8+i] = np.pad(a2[y1:y2, x1:x2],((padl_y,padr_y),(padl_x,padr_x)), mode="edge")
-    return squares
-
-def img2tiles(img):
+    # Gather every square in one fancy index, edge clamping fills out partially over-cropped boards
+    ix = tileIndices(lines_x, stepx, a.shape[1])
+    iy = tileIndices(lines_y, stepy, a.shape[0])
+    # Change order so its A1,B1...H8 for a white-aligned board (rows are top to bottom on screen)
+    iy = iy[::-1]
+    squares = a[iy[:, None, :, None], ix[None, :, None, :]]
+    return squares.reshape([64, stepy, stepx]).astype(np.uint8)
+
+def lanczos(x):
+    """Lanczos-3 kernel"""
+    return np.where(np.abs(x) < 3.0, np.sinc(x) * np.sinc(x/3), 0.0)
+
+def resampleWeights(n, size):
+    """(size, n) matrix resampling n pixels to size pixels with the Lanczos filter of Image.resize
+
+    Image.ADAPTIVE shares its value with Image.LANCZOS, which is the filter the classifier was
+    trained on. The support and centering follow PIL so the weights match its resampler."""
+    scale = n / size
+    support = 3.0 * max(scale, 1.0)
+    center = (np.arange(size) + 0.5) * scale
+    xmin = np.maximum((center - support + 0.5).astype(np.int64), 0)
+    xmax = np.minimum((center + support + 0.5).astype(np.int64), n)
+    x = np.arange(n)
+    weights = lanczos((x[None, :] - center[:, None] + 0.5) / max(scale, 1.0))
+    weights[(x[None, :] < xmin[:, None]) | (x[None, :] >= xmax[:, None])] = 0.0
+    weights /= weights.sum(1, keepdims=True)
+    return weights.astype(np.float32)
+
+def resampleTiles(squares, size=32):
+    """Resize a (k, h, w) uint8 stack of tiles to (k, size, size) float32 in two batched matmuls
+
+    Like PIL the horizontal pass goes first and is rounded back to 8 bits before the vertical one."""
+    _, h, w = squares.shape
+    wy = resampleWeights(h, size)
+    wx = resampleWeights(w, size)
+    tiles = squares.astype(np.float32) @ wx.T
+    np.clip(np.rint(tiles, out=tiles), 0.0, 255.0, out=tiles)
+    tiles = wy @ tiles
+    return np.clip(np.rint(tiles, out=tiles), 0.0, 255.0, out=tiles)
+
+def downsample(a, f):
+    """Box filter a float32 array down by an integer factor (thin grid lines survive, unlike a[::f])"""
+    h, w = a.shape[0] // f, a.shape[1] // f
+    # summing whole rows first keeps the reductions contiguous, several times faster than .mean((1, 3))
+    rows = a[:h*f, :w*f].reshape(h, f, w*f).sum(1)
+    return rows.reshape(h, w, f).sum(2) / (f*f)
+
+def bandProjections(a, lines, extent, f, axis, backend):
+    """Full resolution gradient projection of a, computed only in bands of +-(f+2) px around coarse lines
+
+    lines are coarse pixel indices along axis, extent the (start, stop) of the board across it at
+    full resolution. Everything outside the bands is zero."""
+    proj = np.zeros(a.shape[1 - axis], dtype=np.float32)
+    b = f + 2
+    for line in lines:
+        center = line * f + f // 2
+        # one extra pixel on either side, so the zero padding of the gradient stays out of the band
+        lo, hi = max(center - b - 1, 0), min(center + b + 2, proj.size)
+        band = a[extent[0]:extent[1], lo:hi] if axis == 0 else a[lo:hi, extent[0]:extent[1]]
+        hough = hough_backends[backend](band)[axis]
+        proj[lo+1:hi-1] = hough[1:-1]
+    return proj
+
+def findChessLinesPyramid(a, f, backend="numpy"):
+    """findChessLines on a copy downsampled by f, then refined at full resolution near the lines found
+
+    The gradients are only computed on the coarse image and in narrow bands across the board, so
+    the cost follows the board size rather than the screen size."""
+    lines_x, lines_y, is_match = findChessLines(downsample(a, f), backend, coarse_size=None)
+    if not is_match:
+        return lines_x, lines_y, False
+    stepx = int(np.ceil(np.mean(np.diff(lines_x)))) * f
+    stepy = int(np.ceil(np.mean(np.diff(lines_y)))) * f
+    extent_y = (max(lines_y[0] * f - stepy, 0), min(lines_y[-1] * f + f + stepy, a.shape[0]))
+    extent_x = (max(lines_x[0] * f - stepx, 0), min(lines_x[-1] * f + f + stepx, a.shape[1]))
+    hough_Dx = bandProjections(a, lines_x, extent_y, f, 0, backend)
+    hough_Dy = bandProjections(a, lines_y, extent_x, f, 1, backend)
+    hough_Dx_thresh = hough_Dx.max() * 3 / 5 * 0.9
+    hough_Dy_thresh = hough_Dy.max() * 3 / 5 * 0.9
+    return getChessLines(hough_Dx, hough_Dy, hough_Dx_thresh, hough_Dy_thresh)
+
+# squares narrower than this (in pixels of the downsampled image) blur together in candidateLines
+coarse_min_square = 12
+
+def findChessLines(a, backend="numpy", coarse_size=1280, min_square=24):
+    """Returns the 7 internal chess lines of a float32 grayscale array and whether they form a board
+
+    Arrays longer than coarse_size are searched coarse-to-fine (see findChessLinesPyramid) first,
+    and only searched at full resolution if that finds no board. The downsampling stops where
+    squares of min_square px (the smallest board supported) would become too small to be found."""
+    f = 1
+    while coarse_size and max(a.shape) > coarse_size * f and min_square / (f * 2) >= coarse_min_square:
+        f *= 2
+    if f > 1:
+        lines_x, lines_y, is_match = findChessLinesPyramid(a, f, backend)
+        if is_match:
+            return lines_x, lines_y, is_match
+    hough_Dx, hough_Dy = hough_backends[backend](a)
+    hough_Dx_thresh = hough_Dx.max() * 3 / 5 * 0.9
+    hough_Dy_thresh = hough_Dy.max() * 3 / 5 * 0.9
+    return getChessLines(hough_Dx, hough_Dy, hough_Dx_thresh, hough_Dy_thresh)
+
+def resizeTiles(a, lines_x, lines_y):
+    """Cut the board out of a grayscale array and resize every square to 32x32"""
+    return resampleTiles(getChessTiles(a, lines_x, lines_y))
+
+def img2tiles(img, backend="numpy"):
     a = np.asarray(img.convert("L"), dtype=np.float32)
-    A = tf.Variable(a)
-    Dx = gradientx(A)
-    Dy = gradienty(A)
-    Dx_pos = tf.clip_by_value(Dx,    0.0, 255.0)
-    Dx_neg = tf.clip_by_value(Dx, -255.0,   0.0)
-    Dy_pos = tf.clip_by_value(Dy,    0.0, 255.0)
-    Dy_neg = tf.clip_by_value(Dy, -255.0,   0.0)
-    hough_Dx = tf.reduce_sum(Dx_pos, 0) * tf.reduce_sum(-Dx_neg, 0) / (a.shape[0]*a.shape[0])
-    hough_Dy = tf.reduce_sum(Dy_pos, 1) * tf.reduce_sum(-Dy_neg, 1) / (a.shape[1]*a.shape[1])
-    hough_Dx_thresh = tf.reduce_max(hough_Dx) * 3 / 5 * 0.9
-    hough_Dy_thresh = tf.reduce_max(hough_Dy) * 3 / 5 * 0.9
-    lines_x, lines_y, is_match = getChessLines(hough_Dx.numpy(), hough_Dy.numpy(), hough_Dx_thresh.numpy(), hough_Dy_thresh.numpy())
+    lines_x, lines_y, is_match = findChessLines(a, backend)
     # print("Chessboard found" if is_match else "Couldn"t find Chessboard")
     # print(f"X {lines_x} {np.diff(lines_x)}")
     # print(f"Y {lines_y} {np.diff(lines_y)}")
     tiles = np.empty([64, 32, 32])
     if is_match:
-        tiles_unsized = getChessTiles(a, lines_x, lines_y)
-        for i in range(64):
-            tile = Image.fromarray(tiles_unsized[:,:,i])
-            tile_resized = tile.resize([32, 32], Image.ADAPTIVE)
-            tiles[i,:,:] = np.asarray(tile_resized)
+        tiles = resizeTiles(a, lines_x, lines_y)
     return is_match, tiles
 
+class BoardTracker():
+    """Locks onto the board found in a frame and only looks at that region in later frames
+
+    While locked, a frame is accepted if the gradient projections of the region still peak at the
+    cached lines. Otherwise the lock is dropped and the whole frame is searched again, or, if the
+    frame was only the locked region, the frame is a miss and the next one is grabbed whole."""
+    def __init__(self, backend="numpy", tolerance=1):
+        self.backend = backend
+        self.tolerance = tolerance
+        self.lines_x = None
+        self.lines_y = None
+        self.bbox = None
+        self.locked_frames = 0
+        self.full_searches = 0
+
+    def lock(self, lines_x, lines_y, bounds):
+        """Cache the lines and the board bounding box (plus half a square margin, clipped to bounds)"""
+        stepx = int(np.round(np.mean(np.diff(lines_x))))
+        stepy = int(np.round(np.mean(np.diff(lines_y))))
+        self.lines_x = lines_x
+        self.lines_y = lines_y
+        self.bbox = (int(max(lines_x[0] - stepx - stepx//2, bounds[0])),
+                     int(max(lines_y[0] - stepy - stepy//2, bounds[1])),
+                     int(min(lines_x[-1] + stepx + stepx//2, bounds[2])),
+                     int(min(lines_y[-1] + stepy + stepy//2, bounds[3])))
+
+    def unlock(self):
+        self.lines_x = None
+        self.lines_y = None
+        self.bbox = None
+
+    def confirm(self, a, lines_x, lines_y):
+        """Checks that the gradient projections of a peak within tolerance of every line"""
+        hough_Dx, hough_Dy = hough_backends[self.backend](a)
+        for hough, lines in ((hough_Dx, lines_x), (hough_Dy, lines_y)):
+            thresh = hough.max() * 3 / 5 * 0.9
+            window = np.arange(-self.tolerance, self.tolerance+1)
+            idx = np.clip(lines[:, None] + window, 0, hough.size-1)
+            if not np.all(hough[idx].max(1) > thresh):
+                return False
+        return True
+
+    def img2tiles(self, img, origin=(0, 0)):
+        """Same as img2tiles, but reuses the board geometry of previous frames when possible
+
+        origin is the position of img within the frame, so img can be just the locked region
+        (see capture.RegionGrabber). Coordinates are kept in frame pixels."""
+        ox, oy = origin
+        if self.bbox is not None:
+            x0, y0, x1, y1 = self.bbox[0] - ox, self.bbox[1] - oy, self.bbox[2] - ox, self.bbox[3] - oy
+            if x0 >= 0 and y0 >= 0 and x1 <= img.width and y1 <= img.height:
+                a = np.asarray(img.crop((x0, y0, x1, y1)).convert("L"), dtype=np.float32)
+                lines_x = self.lines_x - self.bbox[0]
+                lines_y = self.lines_y - self.bbox[1]
+                if self.confirm(a, lines_x, lines_y):
+                    self.locked_frames += 1
+                    return True, resizeTiles(a, lines_x, lines_y)
+            region = (ox, oy, ox + img.width, oy + img.height) == self.bbox
+            self.unlock()
+            if region:
+                # the board moved out of the crop, a search limited to it would clip the new lock to it too
+                return False, np.empty([64, 32, 32])
+
+        self.full_searches += 1
+        a = np.asarray(img.convert("L"), dtype=np.float32)
+        lines_x, lines_y, is_match = findChessLines(a, self.backend)
+        tiles = np.empty([64, 32, 32])
+        if is_match:
+            self.lock(lines_x + ox, lines_y + oy, (ox, oy, ox + img.width, oy + img.height))
+            tiles = resizeTiles(a, lines_x, lines_y)
+        return is_match, tiles
+
+DetectedBoard = collections.namedtuple("DetectedBoard", ["rect", "lines_x", "lines_y", "quality", "tiles"])
+
+class Projections():
+    """Gradient projections of strips of one frame, the gradients are only computed once
+
+    columns(y0, y1) is hough_Dx of the rows y0:y1 and rows(x0, x1) hough_Dy of the columns x0:x1
+    (up to the zero padding at the strip edges), each costs one pass over just that strip."""
+    def __init__(self, a):
+        self.buf = np.empty_like(a)
+        self.grad_x = np.empty_like(a)
+        self.grad_y = np.empty_like(a)
+        box_gradient(a, self.buf, self.grad_x)
+        box_gradient(a.T, self.buf.T, self.grad_y.T)
+
+    def columns(self, y0, y1, x0=0, x1=None):
+        return projectGradient(self.grad_x[y0:y1, x0:x1], 0, self.buf[y0:y1, x0:x1])
+
+    def rows(self, x0, x1):
+        return projectGradient(self.grad_y[:, x0:x1], 1, self.buf[:, x0:x1])
+
+def fitLattices(hough, max_lattices, min_quality):
+    """Every 7 line lattice of a projection, strongest first: the span of each lattice found is
+    zeroed and the threshold recomputed from what is left, so weaker boards still stand out"""
+    hough = hough.copy()
+    lattices = []
+    while len(lattices) < max_lattices and hough.max() > 0:
+        lines, matched, quality = fitLattice(candidateLines(hough, hough.max() * 3 / 5 * 0.9))
+        if matched < 7 or quality < min_quality:
+            break
+        step = int(np.round(np.mean(np.diff(lines))))
+        lattices.append((lines, quality))
+        hough[max(lines[0] - step, 0):lines[-1] + step + 1] = 0
+    return lattices
+
+def findBoards(a, max_boards=4, min_quality=0.75):
+    """Finds up to max_boards chess boards in a float32 grayscale array, returns DetectedBoards
+
+    The gradients are computed once for the whole frame. Vertical lines are fitted on the full
+    height column projection; the rows are then only projected across the columns of each
+    lattice found (boards above each other share it), and every board is confirmed by fitting
+    its vertical lines again over just its own rows and columns."""
+    projections = Projections(a)
+    height, width = a.shape
+    boards = []
+    for lines_x, _ in fitLattices(projections.columns(0, height), max_boards, min_quality):
+        stepx = int(np.round(np.mean(np.diff(lines_x))))
+        x0, x1 = int(max(lines_x[0] - stepx, 0)), int(min(lines_x[-1] + stepx + 1, width))
+        for lines_y, quality_y in fitLattices(projections.rows(x0, x1), max_boards - len(boards), min_quality):
+            stepy = int(np.round(np.mean(np.diff(lines_y))))
+            y0, y1 = int(max(lines_y[0] - stepy, 0)), int(min(lines_y[-1] + stepy + 1, height))
+            columns = projections.columns(y0, y1, x0, x1)
+            lines, matched, quality_x = fitLattice(candidateLines(columns, columns.max() * 3 / 5 * 0.9))
+            if matched < 7 or quality_x < min_quality:
+                continue
+            lines_x_board = lines + x0
+            boards.append(DetectedBoard((x0, y0, x1, y1), lines_x_board, lines_y,
+                                        min(quality_x, quality_y), resizeTiles(a, lines_x_board, lines_y)))
+        if len(boards) >= max_boards:
+            break
+    return boards
+
+def img2boards(img, max_boards=4, origin=(0, 0)):
+    """findBoards of an image, with the rects and lines in frame pixels (img at origin in the frame)"""
+    ox, oy = origin
+    boards = findBoards(np.asarray(img.convert("L"), dtype=np.float32), max_boards)
+    return [board._replace(rect=(board.rect[0] + ox, board.rect[1] + oy, board.rect[2] + ox, board.rect[3] + oy),
+                           lines_x=board.lines_x + ox, lines_y=board.lines_y + oy) for board in boards]
+
 if __name__ == "__main__":
     img_dirs = glob.glob("images/*.png")
     img = Image.open(img_dirs[0])
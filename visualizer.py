@@ -1,4 +1,6 @@
+import collections
 import io
+import math
 import os
 
 import chess
@@ -6,9 +8,10 @@ import chess.engine
 import chess.svg
 import numpy as np
 import pygame
-import pyvips
+import pygame.gfxdraw
 from PIL import Image
-from scipy.special import expit, logit
+
+from instrument import Profiler
 
 size = width, height = 900, 900
 white = (255, 255, 255)
@@ -40,7 +43,7 @@ def calc_pl(eval, board):
     else:
         weakness = 0.5+0.40*np.clip(np.abs(eval), 0.0, 7.5)
     num_pieces = len(board.piece_map())
-    weakness = weakness * (1.0-0.3*expit((num_pieces-8)/2)) * 2.2
+    weakness = weakness * (1.0-0.3/(1+math.exp(-(num_pieces-8)/2))) * 2.2
     return weakness
 
 def svg2surface(svg):
@@ -57,6 +60,7 @@ def svg2surface(svg):
         'dpcomplex': np.complex128,
     }
 
+    import pyvips
     img_pv = pyvips.Image.new_from_buffer(svg.encode(), "")
     a = np.ndarray(buffer=img_pv.write_to_memory(),
                    dtype=format_to_dtype[img_pv.format],
@@ -64,74 +68,194 @@ def svg2surface(svg):
     png = Image.fromarray(a).resize((400, 400))
     return pygame.image.fromstring(png.tobytes(), png.size, png.mode).convert()
 
+def svg2sprite(svg):
+    """Rasterise an svg with its alpha channel into a pygame surface"""
+    import pyvips
+    img_pv = pyvips.Image.new_from_buffer(svg.encode(), "")
+    if img_pv.bands == 3:
+        img_pv = img_pv.bandjoin(255)
+    return pygame.image.frombuffer(img_pv.write_to_memory(), (img_pv.width, img_pv.height), "RGBA").convert_alpha()
+
+def parseColor(color, colors=chess.svg.DEFAULT_COLORS):
+    """RGBA tuple of a chess.svg color: a named arrow color, #rgb(a) hex or rgba(r,g,b,a)"""
+    color = colors.get(f"arrow {color}", color)
+    if color.startswith("rgba(") or color.startswith("rgb("):
+        values = [float(v) for v in color[color.index("(")+1:-1].split(",")]
+        alpha = values[3] if len(values) == 4 else 1.0
+        return (int(values[0]), int(values[1]), int(values[2]), int(round(alpha*255)))
+    color = color.lstrip("#")
+    if len(color) in (3, 4):
+        color = "".join(c*2 for c in color)
+    if len(color) == 6:
+        color += "ff"
+    return tuple(int(color[i:i+2], 16) for i in range(0, 8, 2))
+
+class BoardRenderer():
+    """Draws boards straight onto pygame surfaces, the same look as chess.svg.board(coordinates=False)
+
+    The square pattern and the piece sprites are rendered once per size/colors, a frame only blits
+    the pieces and alpha-blends the arrows on top."""
+    def __init__(self, size=400, colors=chess.svg.DEFAULT_COLORS):
+        self.size = size
+        self.square = size / 8
+        self.colors = colors
+
+        self.background = pygame.Surface((size, size)).convert()
+        self.background.fill(parseColor(colors["square light"])[:3])
+        for square in chess.SQUARES:
+            # the pattern is the same from either side, dark squares have an even file+rank
+            if (chess.square_file(square) + chess.square_rank(square)) % 2 == 0:
+                self.background.fill(parseColor(colors["square dark"])[:3], self.squareRect(square, True))
+
+        self.sprites = {}
+        for color in chess.COLORS:
+            for piece_type in chess.PIECE_TYPES:
+                piece = chess.Piece(piece_type, color)
+                self.sprites[piece.symbol()] = svg2sprite(chess.svg.piece(piece, size=round(self.square)))
+
+        self.scratch = pygame.Surface((size, size), pygame.SRCALPHA)
+
+    def squareRect(self, square, is_white):
+        file = chess.square_file(square) if is_white else 7 - chess.square_file(square)
+        rank = 7 - chess.square_rank(square) if is_white else chess.square_rank(square)
+        x0, y0 = round(file*self.square), round(rank*self.square)
+        return pygame.Rect(x0, y0, round((file+1)*self.square) - x0, round((rank+1)*self.square) - y0)
+
+    def squareCenter(self, square, is_white):
+        file = chess.square_file(square) + 0.5 if is_white else 7.5 - chess.square_file(square)
+        rank = 7.5 - chess.square_rank(square) if is_white else chess.square_rank(square) + 0.5
+        return file*self.square, rank*self.square
+
+    def drawArrow(self, surface, tail, head, color, is_white):
+        """Alpha blend one arrow (or a ring if tail == head) with the geometry of chess.svg"""
+        xtail, ytail = self.squareCenter(tail, is_white)
+        xhead, yhead = self.squareCenter(head, is_white)
+        rgb, alpha = color[:3], color[3]
+
+        if tail == head:
+            r = self.square * 0.9 / 2
+            rect = pygame.Rect(0, 0, 2*r+self.square*0.1+2, 2*r+self.square*0.1+2)
+            rect.center = (round(xhead), round(yhead))
+            self.scratch.fill((0, 0, 0, 0), rect)
+            pygame.draw.circle(self.scratch, rgb, rect.center, round(r + self.square*0.05), round(self.square*0.1))
+        else:
+            marker_size = 0.75 * self.square
+            marker_margin = 0.1 * self.square
+            dx, dy = xhead - xtail, yhead - ytail
+            hypot = math.hypot(dx, dy)
+            shaft_x = xhead - dx * (marker_size + marker_margin) / hypot
+            shaft_y = yhead - dy * (marker_size + marker_margin) / hypot
+            xtip = xhead - dx * marker_margin / hypot
+            ytip = yhead - dy * marker_margin / hypot
+            # half stroke width, perpendicular to the arrow
+            wx, wy = -dy * 0.1 * self.square / hypot, dx * 0.1 * self.square / hypot
+            shaft = [(xtail + wx, ytail + wy), (shaft_x + wx, shaft_y + wy),
+                     (shaft_x - wx, shaft_y - wy), (xtail - wx, ytail - wy)]
+            marker = [(xtip, ytip),
+                      (shaft_x + dy * 0.5 * marker_size / hypot, shaft_y - dx * 0.5 * marker_size / hypot),
+                      (shaft_x - dy * 0.5 * marker_size / hypot, shaft_y + dx * 0.5 * marker_size / hypot)]
+            points = shaft + marker
+            xs, ys = [p[0] for p in points], [p[1] for p in points]
+            rect = pygame.Rect(math.floor(min(xs))-1, math.floor(min(ys))-1,
+                               math.ceil(max(xs)-min(xs))+3, math.ceil(max(ys)-min(ys))+3)
+            self.scratch.fill((0, 0, 0, 0), rect)
+            for polygon in (shaft, marker):
+                pygame.gfxdraw.aapolygon(self.scratch, polygon, (*rgb, 255))
+                pygame.gfxdraw.filled_polygon(self.scratch, polygon, (*rgb, 255))
+
+        rect = rect.clip(self.scratch.get_rect())
+        # scale the sprite alpha by the arrow opacity and blend it onto the board
+        self.scratch.fill((255, 255, 255, alpha), rect, special_flags=pygame.BLEND_RGBA_MULT)
+        surface.blit(self.scratch, rect, rect)
+
+    def render(self, board, is_white, arrows=()):
+        """Board surface with the arrows (chess.svg.Arrow or (tail, head) tuples) drawn over it"""
+        surface = self.background.copy()
+        for square, piece in board.piece_map().items():
+            surface.blit(self.sprites[piece.symbol()], self.squareRect(square, is_white))
+        for arrow in arrows:
+            try:
+                tail, head, color = arrow.tail, arrow.head, arrow.color
+            except AttributeError:
+                tail, head = arrow
+                color = "green"
+            self.drawArrow(surface, tail, head, parseColor(color, self.colors), is_white)
+        return surface
+
+class TextCache():
+    """Fonts loaded once, rendered text surfaces memoized by content (least recently used dropped first)"""
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.fonts = {}
+        self.surfaces = collections.OrderedDict()
+
+    def font(self, path, size):
+        if (path, size) not in self.fonts:
+            self.fonts[path, size] = pygame.font.Font(path, size)
+        return self.fonts[path, size]
+
+    def render(self, path, size, text, color):
+        key = (path, size, text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.font(path, size).render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.maxsize:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
 class Visualizer():
-    def __init__(self):
+    def __init__(self, renderer="pygame", fps=30, idle_fps=5, idle_after=30, profiler=None):
         os.environ["SDL_VIDEO_WINDOW_POS"] = f"{1920//2+80}, {1080//2}"
         pygame.init()
         pygame.display.set_icon(pygame.image.fromstring(b'\x00', (1, 1), 'P'))
         self.screen = pygame.display.set_mode(size)
-
-    def render_frame(self, board_allie, multipv_allie,
-                           board_enemy, multipv_enemy,
-                           is_white, board_screen):
-
-        is_focused = pygame.mouse.get_focused()
-        mousepos = pygame.mouse.get_pos()
-        self.screen.fill(black)
-
-        # draw board and get engine for allie's turn - IDENTICAL CODE
-        board = board_allie
-        multipv = multipv_allie
-
-        arrows=[]
-        if is_focused and 80 <= mousepos[0] <= 400 and 420 <= mousepos[1] <= 900:
-            pvrank = (mousepos[1] - 420) // 20
-            moveno = (mousepos[0] - 80) // 80
-            if pvrank < len(multipv):
-                pv = multipv[pvrank].get("pv")
-                if pv:
-                    for move in pv[:moveno+1]:
-                        arrows.append((move.from_square, move.to_square))
-        elif is_focused and 0 <= mousepos[0] <= 400 and 0 <= mousepos[1] <= 400:
-            pass
-        else:
-            scores = [info.get("score") for info in multipv]
-            scores = np.array([score2num(s.relative) if s else -9999 for s in scores]) / 100
-            eval = scores[0]
-            scores_diff = scores - eval
-            scores_diff = np.exp(scores_diff / calc_pl(eval, board)) * 0.8
-            scores_diff = np.clip(scores_diff, 0.0, 0.8)
-            for info, opacity in zip(multipv[:24], scores_diff[:24]):
-                score = info.get("score")
-                pv = info.get("pv")
-                if score and pv and opacity > 0.05:
-                    arrows.append(chess.svg.Arrow(pv[0].from_square, pv[0].to_square, color=f"rgba({dark_green[0]},{dark_green[1]},{dark_green[2]},{opacity:.3f})"))
-
-        board_svg = chess.svg.board(board=board_screen, size=400, orientation=chess.WHITE if is_white else chess.BLACK,
+        # renderer="svg" keeps the original chess.svg -> pyvips path
+        self.board_renderer = BoardRenderer(400) if renderer == "pygame" else None
+        self.text = TextCache()
+        self.sans = collections.OrderedDict()
+        self.panels = {}
+
+        self.regions = {}
+        self.clock = pygame.time.Clock()
+        self.fps = fps
+        self.idle_fps = idle_fps
+        self.idle_after = idle_after
+        self.idle_frames = 0
+
+        self.profiler = profiler or Profiler()
+        self.show_hud = False
+
+    def board_surface(self, board, is_white, arrows):
+        if self.board_renderer:
+            return self.board_renderer.render(board, is_white, arrows)
+        board_svg = chess.svg.board(board=board, size=400, orientation=chess.WHITE if is_white else chess.BLACK,
                                     coordinates=False, arrows=arrows)
-        board_image_pygame = svg2surface(board_svg)
-        self.screen.blit(board_image_pygame, (0,0))
-
-        if is_focused and 0 <= mousepos[0] <= 400 and 0 <= mousepos[1] <= 400:
-            rank = (mousepos[1] - 0) // 50
-            file = (mousepos[0] - 0) // 50
-            square = chess.square_mirror(chess.square(file, rank))
-            square = rotatesquare(square, is_white)
-            for i, info in enumerate(multipv):
-                score = info.get("score")
-                pv = info.get("pv")
-                if score and pv:
-                    score = score2num(score.relative)
-                    move = pv[0]
-                    if square == move.from_square:
-                        to_square_draw = rotatesquare(move.to_square, is_white)
-                        to_square_draw = chess.square_mirror(to_square_draw)
-                        text = f"{score/100:.2f}"
-                        text_pygame = pygame.font.Font(font_bold_dir, 16).render(text, True, dark_green)
-                        text_pygame_rect = text_pygame.get_rect()
-                        text_pygame_rect.center = (25+chess.square_file(to_square_draw)*50, 25+chess.square_rank(to_square_draw)*50)
-                        self.screen.blit(text_pygame, text_pygame_rect)
-                        pygame.draw.rect(self.screen, dark_green, (80, 420+i*20, 320, 20))
+        return svg2surface(board_svg)
+
+    def san_line(self, board, moves):
+        """SAN of a move sequence from board, memoized per (position, moves)"""
+        key = (board.fen(), tuple(moves))
+        sans = self.sans.get(key)
+        if sans is None:
+            board_temp = board.copy(stack=False)
+            sans = []
+            for move in moves:
+                sans.append(board_temp.san(move))
+                board_temp.push(move)
+            self.sans[key] = sans
+            if len(self.sans) > 4096:
+                self.sans.popitem(last=False)
+        return sans
+
+    def pv_panel(self, side, board, multipv):
+        """Status line and the first 24 pvs on a transparent surface, only re-rendered when the
+        board or the multipv snapshot changed (the engines publish a new list for every update)"""
+        cached = self.panels.get(side)
+        if cached and cached[0] is multipv and cached[1] == board:
+            return cached[2]
 
         text = ""
 
@@ -146,96 +270,167 @@ class Visualizer():
             if info.get("score"):
                 score = score2num(info.get("score").relative)
                 text += f"|{score/100:6.2f}|"
-            board_temp = board.copy()
-            for i, move in enumerate(info.get("pv")[:4]) if info.get("pv") else enumerate([]):
-                text += f"|{board_temp.san(move):6s}|"
-                board_temp.push(move)
+            for san in self.san_line(board, info.get("pv")[:4]) if info.get("pv") else []:
+                text += f"|{san:6s}|"
             text += "\n"
 
+        surface = pygame.Surface((500, 500), pygame.SRCALPHA)
         for i, line in enumerate(text.split("\n")):
-            text_pygame = pygame.font.Font(font_dir, 20).render(line, True, white)
-            self.screen.blit(text_pygame, (0,400+20*i))
-
-
-
-        # draw board and get engine for enemy's turn - IDENTICAL CODE
-        board = board_enemy
-        multipv = multipv_enemy
-
+            surface.blit(self.text.render(font_dir, 20, line, white), (0,20*i))
+        self.panels[side] = (multipv, board.copy(stack=False), surface)
+        return surface
+
+    def toggle_hud(self):
+        """Show or hide the profiler overlay (it turns the profiler on)"""
+        self.show_hud = not self.show_hud
+        self.profiler.enabled = self.profiler.enabled or self.show_hud
+        self.invalidate()
+
+    def render_hud(self):
+        """Stage timings, counters and a histogram of recent frame times over the allie board"""
+        font = self.text.font(font_dir, 14)
+        lines = [f"{'stage':16s}{'p50':>7s}{'p95':>7s}{'max':>7s}"]
+        for name, (p50, p95, worst) in sorted(self.profiler.summary().items()):
+            lines.append(f"{name:16s}{p50:7.1f}{p95:7.1f}{worst:7.1f}")
+        for name, n in sorted(self.profiler.counters.items()):
+            lines.append(f"{name}: {n}")
+
+        rect = pygame.Rect(0, 0, 400, 16*len(lines) + 64)
+        overlay = pygame.Surface(rect.size, pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 180))
+        for i, line in enumerate(lines):
+            overlay.blit(font.render(line, True, white), (4, 16*i))
+
+        # histogram of frame times over the window, 0-100 ms in 5 ms bins
+        frames = self.profiler.samples.get("frame")
+        if frames:
+            counts, _ = np.histogram(np.minimum(frames, 99.9), bins=20, range=(0, 100))
+            heights = counts / counts.max() * 56
+            for i, h in enumerate(heights):
+                pygame.draw.rect(overlay, green, (4 + i*19, rect.height - 4 - h, 17, h))
+        self.screen.blit(overlay, rect)
+        return rect
+
+    def invalidate(self):
+        """Redraw the whole window on the next frame (e.g. after it was uncovered)"""
+        self.regions = {}
+
+    def arrows(self, side, offset, board, multipv, is_focused, mousepos):
+        """Arrows for one side: the hovered pv, nothing while hovering the board, otherwise the
+        first move of every line with an opacity fading with how much worse it scores"""
         arrows=[]
-        if is_focused and 580 <= mousepos[0] <= 900 and 420 <= mousepos[1] <= 900:
+        if is_focused and offset+80 <= mousepos[0] <= offset+400 and 420 <= mousepos[1] <= 900:
             pvrank = (mousepos[1] - 420) // 20
-            moveno = (mousepos[0] - 580) // 80
+            moveno = (mousepos[0] - offset - 80) // 80
             if pvrank < len(multipv):
                 pv = multipv[pvrank].get("pv")
                 if pv:
                     for move in pv[:moveno+1]:
                         arrows.append((move.from_square, move.to_square))
-        elif is_focused and 500 <= mousepos[0] <= 900 and 0 <= mousepos[1] <= 400:
+        elif is_focused and offset <= mousepos[0] <= offset+400 and 0 <= mousepos[1] <= 400:
             pass
         else:
             scores = [info.get("score") for info in multipv]
             scores = np.array([score2num(s.relative) if s else -9999 for s in scores]) / 100
             eval = scores[0]
             scores_diff = scores - eval
-            scores_diff = np.exp(scores_diff * calc_pl(eval, board)) * 0.8
+            if side == "allie":
+                scores_diff = np.exp(scores_diff / calc_pl(eval, board)) * 0.8
+            else:
+                scores_diff = np.exp(scores_diff * calc_pl(eval, board)) * 0.8
             scores_diff = np.clip(scores_diff, 0.0, 0.8)
             for info, opacity in zip(multipv[:24], scores_diff[:24]):
                 score = info.get("score")
                 pv = info.get("pv")
                 if score and pv and opacity > 0.05:
                     arrows.append(chess.svg.Arrow(pv[0].from_square, pv[0].to_square, color=f"rgba({dark_green[0]},{dark_green[1]},{dark_green[2]},{opacity:.3f})"))
+        return arrows
 
-        board_svg = chess.svg.board(board=board_screen, size=400, orientation=chess.WHITE if is_white else chess.BLACK,
-                                    coordinates=False, arrows=arrows)
-        board_image_pygame = svg2surface(board_svg)
-        self.screen.blit(board_image_pygame, (500,0))
-
-        if is_focused and 500 <= mousepos[0] <= 900 and 0 <= mousepos[1] <= 400:
+    def hovered_moves(self, offset, multipv, is_white, is_focused, mousepos):
+        """(pv index, move, score) of every line starting from the hovered square"""
+        hovered = []
+        if is_focused and offset <= mousepos[0] <= offset+400 and 0 <= mousepos[1] <= 400:
             rank = (mousepos[1] - 0) // 50
-            file = (mousepos[0] - 500) // 50
+            file = (mousepos[0] - offset) // 50
             square = chess.square_mirror(chess.square(file, rank))
             square = rotatesquare(square, is_white)
             for i, info in enumerate(multipv):
                 score = info.get("score")
                 pv = info.get("pv")
-                if score and pv:
-                    score = score2num(score.relative)
-                    move = pv[0]
-                    if square == move.from_square:
-                        to_square_draw = rotatesquare(move.to_square, is_white)
-                        to_square_draw = chess.square_mirror(to_square_draw)
-                        text = f"{score/100:.2f}"
-                        text_pygame = pygame.font.Font(font_bold_dir, 16).render(text, True, dark_green)
-                        text_pygame_rect = text_pygame.get_rect()
-                        text_pygame_rect.center = (525+chess.square_file(to_square_draw)*50, 25+chess.square_rank(to_square_draw)*50)
-                        self.screen.blit(text_pygame, text_pygame_rect)
-                        pygame.draw.rect(self.screen, dark_green, (580, 420+i*20, 320, 20))
-
-        text = ""
-
-        if board.status() == chess.Status.VALID:
-            text += f"breadth: {len(multipv)} depth: {depth} nodes: {nodes}\n"
-        else:
-            depth = multipv[0].get("depth")
-            nodes = multipv[0].get("nodes")
-            text += str(board.status()) + "\n"
-
-        for info in multipv[:24]:
-            if info.get("score"):
-                score = score2num(info.get("score").relative)
-                text += f"|{score/100:6.2f}|"
-            board_temp = board.copy()
-            for i, move in enumerate(info.get("pv")[:4]) if info.get("pv") else enumerate([]):
-                text += f"|{board_temp.san(move):6s}|"
-                board_temp.push(move)
-            text += "\n"
-
-        for i, line in enumerate(text.split("\n")):
-            text_pygame = pygame.font.Font(font_dir, 20).render(line, True, white)
-            self.screen.blit(text_pygame, (500,400+20*i))
-
+                if score and pv and square == pv[0].from_square:
+                    hovered.append((i, pv[0], score2num(score.relative)))
+        return hovered
+
+    def dirty(self, region, key, multipv):
+        """Whether a region has to be redrawn, multipv is compared by identity and the rest by value"""
+        cached = self.regions.get(region)
+        if cached and cached[0] is multipv and cached[1] == key:
+            return False
+        self.regions[region] = (multipv, key)
+        return True
+
+    def render_side(self, side, offset, board, multipv, is_white, board_screen, is_focused, mousepos):
+        """Redraw the board and pv table of one side if their content changed, returns the dirty rects"""
+        rects = []
+        arrows = self.arrows(side, offset, board, multipv, is_focused, mousepos)
+        hovered = self.hovered_moves(offset, multipv, is_white, is_focused, mousepos)
+
+        arrows_key = [(a.tail, a.head, a.color) if isinstance(a, chess.svg.Arrow) else a for a in arrows]
+        board_rect = pygame.Rect(offset, 0, 400, 400)
+        if self.dirty((side, "board"), (board_screen.copy(stack=False), is_white, arrows_key, hovered), multipv):
+            with self.profiler.stage("render.board"):
+                self.screen.blit(self.board_surface(board_screen, is_white, arrows), board_rect)
+            for i, move, score in hovered:
+                to_square_draw = rotatesquare(move.to_square, is_white)
+                to_square_draw = chess.square_mirror(to_square_draw)
+                text = f"{score/100:.2f}"
+                text_pygame = self.text.render(font_bold_dir, 16, text, dark_green)
+                text_pygame_rect = text_pygame.get_rect()
+                text_pygame_rect.center = (offset+25+chess.square_file(to_square_draw)*50, 25+chess.square_rank(to_square_draw)*50)
+                self.screen.blit(text_pygame, text_pygame_rect)
+            rects.append(board_rect)
+
+        panel_rect = pygame.Rect(offset, 400, 500 if offset == 0 else 400, 500)
+        highlighted = [i for i, _, _ in hovered]
+        if self.dirty((side, "panel"), (board.copy(stack=False), highlighted), multipv):
+            self.screen.fill(black, panel_rect)
+            for i in highlighted:
+                pygame.draw.rect(self.screen, dark_green, (offset+80, 420+i*20, 320, 20))
+            with self.profiler.stage("render.panel"):
+                self.screen.blit(self.pv_panel(side, board, multipv), panel_rect)
+            rects.append(panel_rect)
+        return rects
 
+    def render_frame(self, board_allie, multipv_allie,
+                           board_enemy, multipv_enemy,
+                           is_white, board_screen):
+        """Redraws the regions whose content changed and paces the frame rate
 
-        pygame.display.flip()
+        Runs at fps while something changes and backs off to idle_fps (if any) after idle_frames
+        unchanged frames, leaving the cpu to the engines."""
+        is_focused = pygame.mouse.get_focused()
+        mousepos = pygame.mouse.get_pos()
 
+        with self.profiler.stage("render"):
+            if self.show_hud:
+                # the overlay is drawn over the allie board, which therefore is redrawn every frame
+                self.regions.pop(("allie", "board"), None)
+            full = not self.regions
+            if full:
+                self.screen.fill(black)
+
+            # draw board and get engine for allie's turn
+            rects = self.render_side("allie", 0, board_allie, multipv_allie, is_white, board_screen, is_focused, mousepos)
+            # draw board and get engine for enemy's turn
+            rects += self.render_side("enemy", 500, board_enemy, multipv_enemy, is_white, board_screen, is_focused, mousepos)
+            if self.show_hud:
+                self.render_hud()
+
+            if full:
+                pygame.display.flip()
+            elif rects:
+                pygame.display.update(rects)
+
+        self.idle_frames = 0 if rects else self.idle_frames + 1
+        with self.profiler.stage("pace"):
+            self.clock.tick(self.idle_fps if self.idle_fps and self.idle_frames >= self.idle_after else self.fps)